@@ -0,0 +1,94 @@
+from eth_utils.abi import get_abi_output_types
+from web3 import Web3
+
+# Multicall3 is deployed at the same address on every chain we use (Avalanche Fuji, BSC testnet, ...)
+# See Bridge/lib/forge-std/src/interfaces/IMulticall3.sol
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+MULTICALL3_ABI = [
+    {
+        "type": "function",
+        "name": "aggregate3",
+        "stateMutability": "payable",
+        "inputs": [
+            {
+                "name": "calls",
+                "type": "tuple[]",
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"},
+                ],
+            }
+        ],
+        "outputs": [
+            {
+                "name": "returnData",
+                "type": "tuple[]",
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"},
+                ],
+            }
+        ],
+    }
+]
+
+
+class Multicall:
+    """
+        Collect view calls on any number of contracts and resolve them all with a single eth_call to Multicall3
+        Calls that revert resolve to None instead of failing the whole batch
+    """
+
+    def __init__(self, w3):
+        """
+            w3 - web3 instance connected to the chain all the contracts live on
+        """
+        self.w3 = w3
+        self.calls = []
+
+    def add(self, contract, function, *args):
+        """
+            contract - (contract object)
+            function - (string) name of the view function to call
+            args - the function arguments
+            Returns the position of this call in the list returned by execute()
+        """
+        self.calls.append((contract, function, args))
+        return len(self.calls) - 1
+
+    def execute(self):
+        """
+            Returns the decoded return value of every call added so far, in the order they were added
+            If Multicall3 is not deployed on the chain (the aggregate3 call returns nothing) the calls are made
+            one by one
+        """
+        if not self.calls:
+            return []
+
+        multicall = self.w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+        encoded = [(contract.address, True, contract.encode_abi(function, args=list(args)))
+                   for contract, function, args in self.calls]
+        try:
+            results = multicall.functions.aggregate3(encoded).call()
+        except Exception:
+            return [self.call_one(contract, function, args) for contract, function, args in self.calls]
+
+        values = []
+        for (contract, function, args), (success, return_data) in zip(self.calls, results):
+            if not success or not return_data:
+                values.append(None)
+                continue
+            output_types = get_abi_output_types(contract.get_function_by_name(function).abi)
+            decoded = [Web3.to_checksum_address(value) if output_type == 'address' else value
+                       for output_type, value in zip(output_types, self.w3.codec.decode(output_types, return_data))]
+            values.append(decoded[0] if len(decoded) == 1 else decoded)
+        return values
+
+    @staticmethod
+    def call_one(contract, function, args):
+        try:
+            return getattr(contract.functions, function)(*args).call()
+        except Exception:
+            return None
@@ -4,8 +4,33 @@ import time
 import random
 import pandas as pd
 from web3 import Web3, constants
+from eth_abi import encode as abi_encode
+from eth_account import Account
+from web3.exceptions import BadResponseFormat, Web3RPCError, Web3TypeError
 from pathlib import Path
 from web3.middleware import ExtraDataToPOAMiddleware
+from multicall import Multicall
+
+# Role checked by ensure_balance, keccak256("MINTER_ROLE") as defined by the ERC20 test tokens
+MINTER_ROLE = Web3.keccak(text="MINTER_ROLE")
+
+# EIP-2612 views used to sign permits, they are not part of the grader's ERC20 ABI
+PERMIT_ABI = [
+    {"type": "function", "name": "name", "stateMutability": "view", "inputs": [],
+     "outputs": [{"name": "", "type": "string"}]},
+    {"type": "function", "name": "nonces", "stateMutability": "view",
+     "inputs": [{"name": "owner", "type": "address"}], "outputs": [{"name": "", "type": "uint256"}]},
+    {"type": "function", "name": "DOMAIN_SEPARATOR", "stateMutability": "view", "inputs": [],
+     "outputs": [{"name": "", "type": "bytes32"}]},
+    {"type": "function", "name": "PERMIT_TYPEHASH", "stateMutability": "view", "inputs": [],
+     "outputs": [{"name": "", "type": "bytes32"}]},
+]
+# EIP-712 type hashes of the domain and of the EIP-2612 Permit message signed by sign_permit
+EIP712_DOMAIN_TYPEHASH = Web3.keccak(
+    text="EIP712Domain(string name,string version,uint256 chainId,address verifyingContract)")
+PERMIT_TYPEHASH = Web3.keccak(
+    text="Permit(address owner,address spender,uint256 value,uint256 nonce,uint256 deadline)")
+PERMIT_LIFETIME = 600  # seconds a deposit permit stays valid
 
 
 class bcolors:
@@ -170,6 +195,23 @@ def get_wrapped_token_object(src_token, destination_w3, destination_contract, er
     return wrapped_token
 
 
+def get_tx_metadata(w3, address):
+    """
+        Returns the chain id, gas price and transaction count of address, fetched in a single
+        JSON-RPC batch request when the provider supports it
+    """
+    try:
+        with w3.batch_requests() as batch:
+            batch.add(w3.eth.chain_id)
+            batch.add(w3.eth.gas_price)
+            batch.add(w3.eth.get_transaction_count(address))
+            return tuple(batch.execute())
+    except (Web3TypeError, Web3RPCError, BadResponseFormat):
+        # The provider does not support batching, or the endpoint rejected the batch as a whole
+        # (see rpc_batch.batch_request), make the same calls one at a time
+        return w3.eth.chain_id, w3.eth.gas_price, w3.eth.get_transaction_count(address)
+
+
 def sign_and_send(contract, function, signer, argdict, confirm=True, force_nonce=0):
     """
         contract - (contract object) 
@@ -182,13 +224,13 @@ def sign_and_send(contract, function, signer, argdict, confirm=True, force_nonce
         return from sign_and_send if you know you're going to call the function repeatedly
     """
     w3 = contract.w3
-    nonce = w3.eth.get_transaction_count(signer.address)
+    chain_id, gas_price, nonce = get_tx_metadata(w3, signer.address)
     if nonce <= force_nonce:
         nonce = force_nonce + 1
     contract_func = getattr(contract.functions, function)
     try:
         tx = contract_func(**argdict).build_transaction(
-            {'nonce': nonce, 'gasPrice': w3.eth.gas_price, 'from': signer.address,
+            {'nonce': nonce, 'gasPrice': gas_price, 'chainId': chain_id, 'from': signer.address,
              'gas': 10 ** 6})  # Must set gas price (https://github.com/ethereum/web3.py/issues/2307)
     except Exception as e:
         print(f"{bcolors.FAIL}ERROR{bcolors.ENDC}: in sign_and_send, failed to build "
@@ -214,26 +256,30 @@ def sign_and_send(contract, function, signer, argdict, confirm=True, force_nonce
     return signed_tx.hash.hex(), nonce
 
 
-def ensure_balance(token, user, bal, minter):
+def ensure_balance(token, user, bal, minter, current_balance=None, is_minter=None):
     """
         token - (contract object) an ERC20 token
         user - (address)
         bal - (int)
+        current_balance, is_minter - values already read in a batch (see check_token_registration),
+        read from the chain when None
         Ensure the address "user" has a balance of at least bal in the ERC20 token.
         If the user's balance is below bal, new tokens are minted
     """
 
-    current_balance = token.functions.balanceOf(user).call()
+    if current_balance is None:
+        current_balance = token.functions.balanceOf(user).call()
     if current_balance >= bal:
         return True
 
-    try:
-        is_minter = token.functions.hasRole(token.functions.MINTER_ROLE().call(), minter.address)
-    except Exception as e:
-        print(f"Failed to call 'hasRole'")
-        print("Contact your instructor")
-        print(e)
-        return False
+    if is_minter is None:
+        try:
+            is_minter = token.functions.hasRole(MINTER_ROLE, minter.address).call()
+        except Exception as e:
+            print(f"Failed to call 'hasRole'")
+            print("Contact your instructor")
+            print(e)
+            return False
 
     if not is_minter:
         print(f"{minter.address} is not allowed to mint tokens on {token.address}")
@@ -245,47 +291,61 @@ def ensure_balance(token, user, bal, minter):
     sign_and_send(token, 'mint', minter, {'to': user, 'amount': bal - current_balance})
 
 
-def get_wrapped_token(token, destination_w3, destination_contract, erc20s_abi_file):
+def get_wrapped_tokens(tokens, destination_w3, destination_contract, erc20s_abi_file):
     """
-        token - (contract object) underlying token on source chain
-        Returns a contract object corresponding to the wrapped version of this asset on the destination chain
+        tokens - (list of contract objects) underlying tokens on source chain
+        Returns a contract object for the wrapped version of each token on the destination chain, or None for
+        the tokens that have no wrapped version (createToken was not called for them), looking all of them up
+        with a single multicall
     """
-    try:
-        wrapped_token_address = destination_contract.functions.wrapped_tokens(token.address).call()
-    except Exception as e:
-        print(f"Failed to get wrapped token for {token.address} on contract {destination_contract.address}\n{e}")
-        return None
+    reads = Multicall(destination_w3)
+    for token in tokens:
+        reads.add(destination_contract, 'wrapped_tokens', token.address)
 
     with open(erc20s_abi_file, 'r') as f:
         erc20_abi = json.load(f)
 
-    try:
-        wrapped_token = destination_w3.eth.contract(abi=erc20_abi, address=wrapped_token_address)
-    except Exception as e:
-        print(f"Failed to create token contract object for {wrapped_token_address} "
-              f"on contract {destination_contract.address}\n{e}")
-        return None
-
-    return wrapped_token
+    wrapped_tokens = []
+    for token, wrapped_token_address in zip(tokens, reads.execute()):
+        if wrapped_token_address is None or int(wrapped_token_address, 16) == 0:
+            print(f"Failed to get wrapped token for {token.address} on contract {destination_contract.address}")
+            wrapped_tokens.append(None)
+            continue
+        wrapped_tokens.append(destination_w3.eth.contract(abi=erc20_abi, address=wrapped_token_address))
+    return wrapped_tokens
 
 
 def check_token_registration(source_contract, deposits, destination_contract, minter):
     """
        check erc20s are registered on contracts
+       All the reads are resolved with one multicall per chain
     """
-    not_registered = []
+    source_reads = Multicall(source_contract.w3)
+    destination_reads = Multicall(destination_contract.w3)
     for d in deposits:
         token = d['token']  # Contract object (not address)
         sender = d['sender']  # Account object (not address)
+        source_reads.add(source_contract, 'approved', token.address)
+        source_reads.add(token, 'balanceOf', sender.address)
+        source_reads.add(token, 'hasRole', MINTER_ROLE, minter.address)
+        destination_reads.add(destination_contract, 'wrapped_tokens', token.address)
+    source_results = source_reads.execute()
+    destination_results = destination_reads.execute()
 
-        if not source_contract.functions.approved(token.address).call():
+    not_registered = []
+    for i, d in enumerate(deposits):
+        token = d['token']  # Contract object (not address)
+        sender = d['sender']  # Account object (not address)
+        approved, current_balance, is_minter = source_results[3 * i:3 * i + 3]
+
+        if not approved:
             print(f"\n{bcolors.WARNING}INCOMPLETE{bcolors.ENDC}: you need to call registerToken({token.address})\n"
                   f"Before submitting your assignment")
             not_registered.append(token.address)
         else:
-            ensure_balance(token, sender.address, 10 ** 6, minter)
+            ensure_balance(token, sender.address, 10 ** 6, minter, current_balance, is_minter)
 
-        if constants.ADDRESS_ZERO == destination_contract.functions.wrapped_tokens(token.address).call():
+        if destination_results[i] in (None, constants.ADDRESS_ZERO):
             print(f"\n{bcolors.WARNING}INCOMPLETE{bcolors.ENDC}:  you need to call createToken({token.address})\n"
                   f"Before submitting your assignment")
             not_registered.append(token.address)
@@ -303,19 +363,113 @@ def check_contract_addresses(source, destination):
     return True
 
 
+def sign_permit(owner, token_address, token_name, chain_id, spender, amount, permit_nonce, deadline, version="1"):
+    """
+        owner - (account object) the token holder
+        token_address - (address) an EIP-2612 token
+        token_name, chain_id, version - the token's EIP-712 domain
+        spender - (address) the contract allowed to transfer the tokens
+        amount - (int)
+        permit_nonce - (int) the owner's current nonces(owner) on the token
+        deadline - (int) unix time after which the permit is rejected
+
+        Returns the (v, r, s) signature of the permit, signed locally without any call to the chain
+    """
+    signed = Account.sign_typed_data(
+        owner.key,
+        domain_data={'name': token_name, 'version': version, 'chainId': chain_id, 'verifyingContract': token_address},
+        message_types={'Permit': [{'name': 'owner', 'type': 'address'}, {'name': 'spender', 'type': 'address'},
+                                  {'name': 'value', 'type': 'uint256'}, {'name': 'nonce', 'type': 'uint256'},
+                                  {'name': 'deadline', 'type': 'uint256'}]},
+        message_data={'owner': owner.address, 'spender': spender, 'value': amount, 'nonce': permit_nonce,
+                      'deadline': deadline})
+    return signed.v, signed.r.to_bytes(32, 'big'), signed.s.to_bytes(32, 'big')
+
+
+def permit_domain_separator(token_name, chain_id, token_address, version="1"):
+    """
+        Returns the EIP-712 domain separator sign_permit signs under, to compare with the token's DOMAIN_SEPARATOR()
+    """
+    return Web3.keccak(abi_encode(['bytes32', 'bytes32', 'bytes32', 'uint256', 'address'],
+                                  [EIP712_DOMAIN_TYPEHASH, Web3.keccak(text=token_name), Web3.keccak(text=version),
+                                   chain_id, token_address]))
+
+
+def get_permit_domains(deposits, source_contract, chain_id):
+    """
+        Returns, for each deposit, the (token name, sender's permit nonce) needed to sign a permit,
+        or None if the token does not support EIP-2612 or the Source contract has no depositWithPermit
+        A token only gets a permit if its DOMAIN_SEPARATOR() is the domain sign_permit signs under and it does
+        not declare another permit type (e.g. DAI's): any other permit would be rejected, and the deposit is
+        made with approve and deposit instead
+        All the reads are resolved with one multicall
+    """
+    if not any(f.get('name') == 'depositWithPermit' for f in source_contract.abi):
+        return [None] * len(deposits)
+
+    w3 = source_contract.w3
+    reads = Multicall(w3)
+    for d in deposits:
+        token = w3.eth.contract(abi=PERMIT_ABI, address=d['token'].address)
+        reads.add(token, 'name')
+        reads.add(token, 'nonces', d['sender'].address)
+        reads.add(token, 'DOMAIN_SEPARATOR')
+        reads.add(token, 'PERMIT_TYPEHASH')
+    results = reads.execute()
+
+    domains = []
+    for i, d in enumerate(deposits):
+        token_name, permit_nonce, domain_separator, permit_typehash = results[4 * i:4 * i + 4]
+        if token_name is None or permit_nonce is None or domain_separator is None:
+            domains.append(None)
+        elif bytes(domain_separator) != permit_domain_separator(token_name, chain_id, d['token'].address):
+            domains.append(None)
+        elif permit_typehash is not None and bytes(permit_typehash) != PERMIT_TYPEHASH:
+            domains.append(None)
+        else:
+            domains.append((token_name, permit_nonce))
+    return domains
+
+
 def make_deposits(deposits, source_contract):
     """
         deposits - (list of dictionaries)  
         Make deposits on the source chain
+        Tokens that support EIP-2612 are deposited in a single depositWithPermit transaction signed offline,
+        the others need an approve transaction first
     """
     print(f"SourceContract.address = {source_contract.address}")
     nonce = 0
-    for d in deposits:
+    chain_id = source_contract.w3.eth.chain_id
+    domains = get_permit_domains(deposits, source_contract, chain_id)
+    permit_nonces = {}
+    for d, domain in zip(deposits, domains):
         token = d['token']  # Contract object (not address)
         sender = d['sender']  # Account object (not address)
         receiver = d['receiver']  # address
         amount = d['amount']  # int
 
+        if domain is not None:
+            token_name, permit_nonce = domain
+            # Several deposits of the same token by the same sender use consecutive permit nonces
+            permit_nonce = permit_nonces.get((token.address, sender.address), permit_nonce)
+            permit_nonces[(token.address, sender.address)] = permit_nonce + 1
+            deadline = int(time.time()) + PERMIT_LIFETIME
+            v, r, s = sign_permit(sender, token.address, token_name, chain_id, source_contract.address, amount,
+                                  permit_nonce, deadline)
+            try:
+                transaction_hash, nonce = sign_and_send(source_contract,
+                                                        "depositWithPermit",
+                                                        sender,
+                                                        {'_token': token.address, '_recipient': receiver,
+                                                         '_amount': amount, '_deadline': deadline,
+                                                         'v': v, 'r': r, 's': s},
+                                                        force_nonce=nonce)
+                print(f"Deposit transaction Hash = {transaction_hash}\n")
+            except Exception as e:
+                print(f"{bcolors.FAIL}ERROR{bcolors.ENDC}: deposit transaction failed on source chain\n{e}\n")
+            continue
+
         try:
             transaction_hash, nonce = sign_and_send(token,
                                                     "approve", 
@@ -376,6 +530,7 @@ def check_for_wrap(destination_w3, destination_contract):
         data = {
             'event': evt.event,  # Wrap
             'block_number': evt.blockNumber,
+            'log_index': evt.logIndex,
             'underlying_token': evt.args['underlying_token'],
             'wrapped_token': evt.args['wrapped_token'],
             'to': evt.args['to'],
@@ -403,6 +558,7 @@ def check_for_withdrawal(source_w3, source_contract):
         data = {
             'event': evt.event,  # Withdrawal
             'block_number': evt.blockNumber,
+            'log_index': evt.logIndex,
             'token': evt.args['token'],
             'recipient': evt.args['recipient'],
             'amount': evt.args['amount'],
@@ -414,6 +570,21 @@ def check_for_withdrawal(source_w3, source_contract):
     return withdrawal_events
 
 
+def reconcile_transfers(transfers, relays):
+    """
+        transfers - (list of tuples) (token, recipient, amount) of each transfer the grader made, in order
+        relays - (list of tuples) (token, recipient, amount, block number, log index, transaction hash)
+                 of each relay event found
+        Returns a reconcile.Reconciliation of the transfers with the relays
+    """
+    from reconcile import COLUMNS, Reconciliation, index_transfers
+
+    transfers = pd.DataFrame([(token, recipient, amount, i, 0, '') for i, (token, recipient, amount)
+                              in enumerate(transfers)], columns=COLUMNS)
+    relays = pd.DataFrame(relays, columns=COLUMNS)
+    return Reconciliation(index_transfers(transfers), index_transfers(relays))
+
+
 def validate(code_path):
 
     contract_file = code_path / "contract_info.json"
@@ -473,11 +644,6 @@ def validate(code_path):
          'sender': user_a,
          'receiver': user_b.address,
          'amount': random.randint(10, 1000)} for token in tokens]
-    withdrawals = [
-        {'token': get_wrapped_token(t['token'], destination_w3, destination_contract, erc20s_abi_file),
-         'sender': user_b,
-         'receiver': user_a.address,
-         'amount': t['amount']} for t in deposits]
 
     # Verify that the student registered the tokens they recorded in the erc20s.csv
     if not check_token_registration(source_contract, deposits, destination_contract, minter):
@@ -486,6 +652,19 @@ def validate(code_path):
         print(f"{bcolors.OKGREEN}SUCCESS{bcolors.ENDC}: ERC20s are valid and registered")
     setup_points += 10  # Points for registering tokens
 
+    wrapped_tokens = get_wrapped_tokens([t['token'] for t in deposits], destination_w3, destination_contract,
+                                        erc20s_abi_file)
+    missing = [t['token'].address for t, wrapped_token in zip(deposits, wrapped_tokens) if wrapped_token is None]
+    if missing:
+        print(f"{bcolors.FAIL}ERROR{bcolors.ENDC}: No wrapped token on the destination contract for "
+              f"{', '.join(missing)}\nCall createToken on your destination contract for every token in erc20s.csv")
+        return setup_points
+    withdrawals = [
+        {'token': wrapped_token,
+         'sender': user_b,
+         'receiver': user_a.address,
+         'amount': t['amount']} for t, wrapped_token in zip(deposits, wrapped_tokens)]
+
     """
     If the code hasn't returned at this point then the final score
     will be the greater of "setup_points" or
@@ -512,15 +691,11 @@ def validate(code_path):
         time.sleep(5)
         wrap_events = check_for_wrap(destination_w3, destination_contract)
     score = 0
-    for d in deposits:
-        for w in wrap_events:
-            if d['receiver'] == w['to'] and d['amount'] == w['amount'] and d['token'].address == w['underlying_token']:
-                score += 1
-                break
-            else:
-                print(f"{d['receiver']} ?= {w['to']}\n"
-                      f"{d['amount']} ?= {w['amount']}\n"
-                      f"{d['token'].address} ?= {w['underlying_token']}")
+    wraps = reconcile_transfers([(d['token'].address, d['receiver'], d['amount']) for d in deposits],
+                                [(w['underlying_token'], w['to'], w['amount'], w['block_number'], w['log_index'],
+                                  w['transactionHash']) for w in wrap_events])
+    wraps.report("deposit -> wrap")
+    score += len(wraps.matched)
 
     ############################################################
     # Now we test the reverse direction
@@ -544,17 +719,14 @@ def validate(code_path):
         time.sleep(5)
         withdrawal_events = check_for_wrap(destination_w3, destination_contract)
 
-    for u in withdrawals:
-        for w in withdrawal_events:
-            if u['receiver'] == w['recipient'] and \
-                    u['amount'] == w['amount'] and \
-                    destination_contract.functions.underlying_tokens(u['token'].address).call() == w['token']:
-                score += 1
-                break
-            else:
-                print(f"{u['receiver']} ?= {w['recipient']}")
-                print(f"{u['amount']} ?= {w['amount']}")
-                print(f"{destination_contract.functions.underlying_tokens(u['token'].address).call()} ?= {w['token']}")
+    # The withdrawals were made from the wrapped tokens of the deposits, so their underlying tokens are
+    # the deposited tokens and no RPC lookup is needed
+    unwraps = reconcile_transfers([(d['token'].address, u['receiver'], u['amount'])
+                                   for d, u in zip(deposits, withdrawals)],
+                                  [(w['token'], w['recipient'], w['amount'], w['block_number'], w['log_index'],
+                                    w['transactionHash']) for w in withdrawal_events])
+    unwraps.report("unwrap -> withdrawal")
+    score += len(unwraps.matched)
 
     return max((100.0 * (float(score) / (2 * len(deposits)))), setup_points)
 
@@ -2,6 +2,7 @@
 pragma solidity ^0.8.17;
 
 import "@openzeppelin/contracts/token/ERC20/ERC20.sol";
+import "@openzeppelin/contracts/token/ERC20/extensions/draft-IERC20Permit.sol";
 import "@openzeppelin/contracts/access/AccessControl.sol";
 
 contract Source is AccessControl {
@@ -22,6 +23,18 @@ contract Source is AccessControl {
     }
 
 	function deposit(address _token, address _recipient, uint256 _amount) public {
+        _deposit(_token, _recipient, _amount);
+    }
+
+    function depositWithPermit(address _token, address _recipient, uint256 _amount, uint256 _deadline, uint8 v, bytes32 r, bytes32 s) public {
+        // Approve this contract with the sender's EIP-2612 signature and deposit in the same transaction
+        // If the permit was already used (e.g. someone front-ran it) the allowance is in place and the deposit can go ahead,
+        // otherwise transferFrom reverts for lack of allowance
+        try IERC20Permit(_token).permit(msg.sender, address(this), _amount, _deadline, v, r, s) {} catch {}
+        _deposit(_token, _recipient, _amount);
+    }
+
+    function _deposit(address _token, address _recipient, uint256 _amount) internal {
         // Check if the token is registered/approved
         require(approved[_token], "Token not registered");
         
@@ -36,7 +49,19 @@ contract Source is AccessControl {
 
     function withdraw(address _token, address _recipient, uint256 _amount) onlyRole(WARDEN_ROLE) public {
         // Function already has role check via modifier
-        
+        _withdraw(_token, _recipient, _amount);
+    }
+
+    function withdrawBatch(address[] calldata _tokens, address[] calldata _recipients, uint256[] calldata _amounts) onlyRole(WARDEN_ROLE) public {
+        // Relay several unwraps in one transaction, each one still emits its own Withdrawal event
+        require(_tokens.length == _recipients.length && _recipients.length == _amounts.length, "Array lengths do not match");
+
+        for (uint256 i = 0; i < _tokens.length; i++) {
+            _withdraw(_tokens[i], _recipients[i], _amounts[i]);
+        }
+    }
+
+    function _withdraw(address _token, address _recipient, uint256 _amount) internal {
         // Transfer tokens from this contract to recipient
         ERC20 token = ERC20(_token);
         bool success = token.transfer(_recipient, _amount);
@@ -114,6 +114,75 @@ contract DestinationTest is Test {
 		destination.wrap(token_address,d_recipient, amount);
     }
 
+	function testApprovedWrapBatch(address d_recipient, uint256 amount) public {
+		vm.assume( d_recipient != address(0) );
+		vm.assume( d_recipient != admin );
+		vm.assume( amount < max_amount / 2 );
+		vm.assume( amount > 0 );
+
+		address wtoken = testCreation();
+
+		address[] memory tokens = new address[](2);
+		address[] memory recipients = new address[](2);
+		uint256[] memory amounts = new uint256[](2);
+		tokens[0] = address(underlying_token);
+		tokens[1] = address(underlying_token);
+		recipients[0] = d_recipient;
+		recipients[1] = d_recipient;
+		amounts[0] = amount;
+		amounts[1] = amount + 1;
+
+		uint256 previous_balance = ERC20(wtoken).balanceOf(d_recipient);
+		vm.expectEmit(true,true,true,true);
+		emit Wrap(address(underlying_token),wtoken,d_recipient,amounts[0]);
+		vm.expectEmit(true,true,true,true);
+		emit Wrap(address(underlying_token),wtoken,d_recipient,amounts[1]);
+		vm.prank(admin);
+		destination.wrapBatch(tokens, recipients, amounts);
+		assertEq( ERC20(wtoken).balanceOf(d_recipient), previous_balance + amounts[0] + amounts[1] );
+	}
+
+	function testUnapprovedWrapBatch(address user, address d_recipient, uint256 amount) public {
+		vm.assume( d_recipient != address(0) );
+		vm.assume( user != admin );
+		vm.assume( amount < max_amount );
+		vm.assume( amount > 0 );
+
+		testCreation();
+
+		address[] memory tokens = new address[](1);
+		address[] memory recipients = new address[](1);
+		uint256[] memory amounts = new uint256[](1);
+		tokens[0] = address(underlying_token);
+		recipients[0] = d_recipient;
+		amounts[0] = amount;
+
+		vm.prank(user);
+		vm.expectRevert();
+		destination.wrapBatch(tokens, recipients, amounts);
+	}
+
+	function testMismatchedWrapBatch(address d_recipient, uint256 amount) public {
+		vm.assume( d_recipient != address(0) );
+		vm.assume( amount < max_amount );
+		vm.assume( amount > 0 );
+
+		testCreation();
+
+		address[] memory tokens = new address[](2);
+		address[] memory recipients = new address[](1);
+		uint256[] memory amounts = new uint256[](2);
+		tokens[0] = address(underlying_token);
+		tokens[1] = address(underlying_token);
+		recipients[0] = d_recipient;
+		amounts[0] = amount;
+		amounts[1] = amount;
+
+		vm.prank(admin);
+		vm.expectRevert();
+		destination.wrapBatch(tokens, recipients, amounts);
+	}
+
 	function testUnwrap(address user, address recipient, uint256 amount ) public {
 		vm.assume( amount > 0 );
 		vm.assume( user != address(0) );
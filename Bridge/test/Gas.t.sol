@@ -0,0 +1,208 @@
+// SPDX-License-Identifier: UNLICENSED
+pragma solidity ^0.8.17;
+
+import "forge-std/Test.sol";
+import "../src/Source.sol";
+import "../src/Destination.sol";
+import "../src/BridgeToken.sol";
+
+/*
+   Gas budgets for every bridge entry point
+   Each test measures a single call with gasleft() and fails if it uses more than its budget, so a change that makes
+   a path more expensive fails `forge test`. Run `forge test --match-contract GasTest -vv` to see the measured values.
+
+   "cold" calls write storage that was empty (a first deposit of a token, a recipient with no balance yet),
+   "warm" calls update storage that is already set, which is the common case for the warden.
+   The budgets are the execution gas of each call (without the 21000 base cost and calldata) with about 15% headroom.
+   When a change makes a path cheaper, lower its budget to lock the saving in.
+*/
+contract GasTest is Test {
+	uint256 constant REGISTER_TOKEN = 86000;
+	uint256 constant CREATE_TOKEN = 1750000;
+	uint256 constant DEPOSIT_COLD = 56000;
+	uint256 constant DEPOSIT_WARM = 36000;
+	uint256 constant WITHDRAW_COLD = 49000;
+	uint256 constant WITHDRAW_WARM = 29000;
+	uint256 constant WRAP_COLD = 74000;
+	uint256 constant WRAP_WARM = 35000;
+	uint256 constant UNWRAP_PARTIAL = 32000;
+	uint256 constant UNWRAP_ALL = 27000;
+	uint256 constant MINT_COLD = 42000;
+	uint256 constant MINT_WARM = 22000;
+	uint256 constant BURN_FROM_MINTER = 22000;
+	uint256 constant BURN_FROM_ALLOWANCE = 28000;
+	// Per relayed transfer, a batch must stay cheaper than the same relays sent one by one
+	uint256 constant BATCH_SIZE = 10;
+
+	Source public source;
+	Destination public destination;
+	BridgeToken public token;  // registered and already held by the Source contract
+	BridgeToken public cold_token;  // registered, never deposited and not created on the destination side
+	BridgeToken public unregistered_token;
+	address public wrapped_token;
+
+	address admin = vm.addr(uint256(keccak256(abi.encodePacked("admin"))));
+	address depositor = vm.addr(uint256(keccak256(abi.encodePacked("depositor"))));
+	address holder = vm.addr(uint256(keccak256(abi.encodePacked("holder"))));
+	address new_user = vm.addr(uint256(keccak256(abi.encodePacked("new user"))));
+	address spender = vm.addr(uint256(keccak256(abi.encodePacked("spender"))));
+	uint256 amount = 1 ether;
+
+	function setUp() public {
+		source = new Source(admin);
+		destination = new Destination(admin);
+		token = new BridgeToken(address(0), "Underlying", "UND", admin);
+		cold_token = new BridgeToken(address(0), "Cold", "CLD", admin);
+		unregistered_token = new BridgeToken(address(0), "Unregistered", "UNR", admin);
+
+		vm.startPrank(admin);
+		token.mint(depositor, 1000 * amount);
+		cold_token.mint(depositor, 1000 * amount);
+		token.mint(holder, 1000 * amount);
+		source.registerToken(address(token));
+		source.registerToken(address(cold_token));
+		wrapped_token = destination.createToken(address(token), "Wrapped", "WUND");
+		destination.wrap(address(token), holder, 100 * amount);
+		vm.stopPrank();
+
+		vm.startPrank(depositor);
+		token.approve(address(source), type(uint256).max);
+		cold_token.approve(address(source), type(uint256).max);
+		source.deposit(address(token), depositor, 100 * amount);
+		vm.stopPrank();
+
+		vm.prank(holder);
+		token.approve(spender, type(uint256).max);
+	}
+
+	function checkGas(string memory label, uint256 used, uint256 budget) internal {
+		emit log_named_uint(label, used);
+		assertLe(used, budget, string.concat(label, " is over its gas budget"));
+	}
+
+	function testGasRegisterToken() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		source.registerToken(address(unregistered_token));
+		checkGas("registerToken", gas - gasleft(), REGISTER_TOKEN);
+	}
+
+	function testGasCreateToken() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		destination.createToken(address(cold_token), "Wrapped Cold", "WCLD");
+		checkGas("createToken", gas - gasleft(), CREATE_TOKEN);
+	}
+
+	function testGasDepositCold() public {
+		vm.prank(depositor);
+		uint256 gas = gasleft();
+		source.deposit(address(cold_token), new_user, amount);
+		checkGas("deposit (cold)", gas - gasleft(), DEPOSIT_COLD);
+	}
+
+	function testGasDepositWarm() public {
+		vm.prank(depositor);
+		uint256 gas = gasleft();
+		source.deposit(address(token), holder, amount);
+		checkGas("deposit (warm)", gas - gasleft(), DEPOSIT_WARM);
+	}
+
+	function testGasWithdrawCold() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		source.withdraw(address(token), new_user, amount);
+		checkGas("withdraw (cold)", gas - gasleft(), WITHDRAW_COLD);
+	}
+
+	function testGasWithdrawWarm() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		source.withdraw(address(token), holder, amount);
+		checkGas("withdraw (warm)", gas - gasleft(), WITHDRAW_WARM);
+	}
+
+	function testGasWrapCold() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		destination.wrap(address(token), new_user, amount);
+		checkGas("wrap (cold)", gas - gasleft(), WRAP_COLD);
+	}
+
+	function testGasWrapWarm() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		destination.wrap(address(token), holder, amount);
+		checkGas("wrap (warm)", gas - gasleft(), WRAP_WARM);
+	}
+
+	function testGasUnwrapPartial() public {
+		vm.prank(holder);
+		uint256 gas = gasleft();
+		destination.unwrap(wrapped_token, holder, amount);
+		checkGas("unwrap (partial balance)", gas - gasleft(), UNWRAP_PARTIAL);
+	}
+
+	function testGasUnwrapAll() public {
+		uint256 balance = BridgeToken(wrapped_token).balanceOf(holder);
+		vm.prank(holder);
+		uint256 gas = gasleft();
+		destination.unwrap(wrapped_token, holder, balance);
+		checkGas("unwrap (whole balance)", gas - gasleft(), UNWRAP_ALL);
+	}
+
+	function testGasMintCold() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		token.mint(new_user, amount);
+		checkGas("mint (cold)", gas - gasleft(), MINT_COLD);
+	}
+
+	function testGasMintWarm() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		token.mint(holder, amount);
+		checkGas("mint (warm)", gas - gasleft(), MINT_WARM);
+	}
+
+	function testGasBurnFromMinter() public {
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		token.burnFrom(holder, amount);
+		checkGas("burnFrom (minter)", gas - gasleft(), BURN_FROM_MINTER);
+	}
+
+	function testGasBurnFromAllowance() public {
+		vm.prank(spender);
+		uint256 gas = gasleft();
+		token.burnFrom(holder, amount);
+		checkGas("burnFrom (allowance)", gas - gasleft(), BURN_FROM_ALLOWANCE);
+	}
+
+	function batch() internal view returns (address[] memory tokens, address[] memory recipients, uint256[] memory amounts) {
+		tokens = new address[](BATCH_SIZE);
+		recipients = new address[](BATCH_SIZE);
+		amounts = new uint256[](BATCH_SIZE);
+		for( uint256 i = 0; i < BATCH_SIZE; i++ ) {
+			tokens[i] = address(token);
+			recipients[i] = holder;
+			amounts[i] = amount;
+		}
+	}
+
+	function testGasWrapBatch() public {
+		(address[] memory tokens, address[] memory recipients, uint256[] memory amounts) = batch();
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		destination.wrapBatch(tokens, recipients, amounts);
+		checkGas("wrapBatch (warm, per transfer)", (gas - gasleft()) / BATCH_SIZE, WRAP_WARM);
+	}
+
+	function testGasWithdrawBatch() public {
+		(address[] memory tokens, address[] memory recipients, uint256[] memory amounts) = batch();
+		vm.prank(admin);
+		uint256 gas = gasleft();
+		source.withdrawBatch(tokens, recipients, amounts);
+		checkGas("withdrawBatch (warm, per transfer)", (gas - gasleft()) / BATCH_SIZE, WITHDRAW_WARM);
+	}
+}
@@ -4,6 +4,7 @@ pragma solidity ^0.8.17;
 import "forge-std/Test.sol";
 import "../src/Source.sol";
 import "@openzeppelin/contracts/token/ERC20/ERC20.sol";
+import "@openzeppelin/contracts/token/ERC20/extensions/draft-ERC20Permit.sol";
 
 contract MToken is ERC20 {
 	constructor(string memory name, string memory symbol,uint256 supply) ERC20(name,symbol) {
@@ -11,6 +12,12 @@ contract MToken is ERC20 {
 	}
 }
 
+contract PToken is ERC20, ERC20Permit {
+	constructor(string memory name, string memory symbol,uint256 supply) ERC20(name,symbol) ERC20Permit(name) {
+		_mint(msg.sender, supply );
+	}
+}
+
 contract SourceTest is Test {
     Source public source;
 
@@ -23,6 +30,8 @@ contract SourceTest is Test {
 	event Withdrawal( address indexed token, address indexed recipient, uint256 amount );
 	event Registration( address indexed token );
 
+	bytes32 constant PERMIT_TYPEHASH = keccak256("Permit(address owner,address spender,uint256 value,uint256 nonce,uint256 deadline)");
+
 
     function setUp() public {
 		source = new Source(admin);
@@ -140,6 +149,90 @@ contract SourceTest is Test {
 
     }
 
+    function testApprovedWithdrawalBatch(address depositor, address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( depositor != address(0) );
+		vm.assume( depositor != admin );
+		vm.assume( recipient != admin );
+		vm.assume( depositor != recipient );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 20 );
+
+		address token_address = testApprovedDeposit( depositor, recipient, amount );
+		MToken token = MToken(token_address);
+		uint256 previous_balance = token.balanceOf(depositor);
+		uint256 previous_source_balance = token.balanceOf(address(source));
+
+		address[] memory tokens = new address[](2);
+		address[] memory recipients = new address[](2);
+		uint256[] memory amounts = new uint256[](2);
+		tokens[0] = token_address;
+		tokens[1] = token_address;
+		recipients[0] = depositor;
+		recipients[1] = depositor;
+		amounts[0] = 10;
+		amounts[1] = amount - 20;
+
+		vm.prank(admin);
+		vm.expectEmit(true,true,false,true);
+		emit Withdrawal( token_address, depositor, amounts[0] );
+		vm.expectEmit(true,true,false,true);
+		emit Withdrawal( token_address, depositor, amounts[1] );
+		source.withdrawBatch( tokens, recipients, amounts );
+
+		assertEq( amount - 10, token.balanceOf(depositor) - previous_balance );
+		assertEq( amount - 10, previous_source_balance - token.balanceOf(address(source)) );
+    }
+
+    function testUnapprovedWithdrawalBatch(address withdrawer, address depositor, address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( depositor != address(0) );
+		vm.assume( depositor != admin );
+		vm.assume( recipient != admin );
+		vm.assume( withdrawer != admin );
+		vm.assume( depositor != recipient );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 20 );
+
+		address token_address = testApprovedDeposit( depositor, recipient, amount );
+
+		address[] memory tokens = new address[](1);
+		address[] memory recipients = new address[](1);
+		uint256[] memory amounts = new uint256[](1);
+		tokens[0] = token_address;
+		recipients[0] = depositor;
+		amounts[0] = amount - 10;
+
+		vm.prank(withdrawer);
+		vm.expectRevert();
+		source.withdrawBatch( tokens, recipients, amounts );
+    }
+
+    function testMismatchedWithdrawalBatch(address depositor, address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( depositor != address(0) );
+		vm.assume( depositor != admin );
+		vm.assume( recipient != admin );
+		vm.assume( depositor != recipient );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 20 );
+
+		address token_address = testApprovedDeposit( depositor, recipient, amount );
+
+		address[] memory tokens = new address[](2);
+		address[] memory recipients = new address[](2);
+		uint256[] memory amounts = new uint256[](1);
+		tokens[0] = token_address;
+		tokens[1] = token_address;
+		recipients[0] = depositor;
+		recipients[1] = depositor;
+		amounts[0] = 10;
+
+		vm.prank(admin);
+		vm.expectRevert("Array lengths do not match");
+		source.withdrawBatch( tokens, recipients, amounts );
+    }
+
     function testUnapprovedWithdrawal(address withdrawer, address depositor, address recipient, uint256 amount) public {
 		vm.assume( recipient != address(0) );
 		vm.assume( depositor != address(0) );
@@ -159,4 +252,95 @@ contract SourceTest is Test {
 
     }
 
+	function signPermit(PToken token, uint256 owner_sk, address spender, uint256 amount, uint256 deadline) internal view returns( uint8 v, bytes32 r, bytes32 s ) {
+		address owner = vm.addr(owner_sk);
+		bytes32 struct_hash = keccak256(abi.encode(PERMIT_TYPEHASH, owner, spender, amount, token.nonces(owner), deadline));
+		(v, r, s) = vm.sign(owner_sk, keccak256(abi.encodePacked("\x19\x01", token.DOMAIN_SEPARATOR(), struct_hash)));
+	}
+
+	function permitToken(address depositor, uint256 amount) internal returns( PToken token ) {
+		vm.prank(token_owner);
+		token = new PToken('Stegosaurus','STG',5*amount );
+		vm.prank(admin);
+		source.registerToken(address(token));
+		vm.prank(token_owner);
+		token.transfer( depositor, 2*amount );
+	}
+
+    function testDepositWithPermit(uint256 depositor_sk, address recipient, uint256 amount) public {
+		vm.assume( depositor_sk > 0 );
+		vm.assume( depositor_sk < 115792089237316195423570985008687907852837564279074904382605163141518161494337 );
+		address depositor = vm.addr(depositor_sk);
+		vm.assume( depositor != token_owner );
+		vm.assume( recipient != address(0) );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 0 );
+
+		PToken token = permitToken(depositor, amount);
+		uint256 deadline = block.timestamp + 600;
+		(uint8 v, bytes32 r, bytes32 s) = signPermit(token, depositor_sk, address(source), amount, deadline);
+
+		// No approve transaction, the signature is enough
+		vm.expectEmit(true,true,false,true);
+		emit Deposit( address(token), recipient, amount );
+		vm.prank(depositor);
+		source.depositWithPermit( address(token), recipient, amount, deadline, v, r, s );
+
+		assertEq( amount, token.balanceOf(address(source)) );
+		assertEq( amount, token.balanceOf(depositor) );
+		assertEq( 0, token.allowance(depositor, address(source)) );
+    }
+
+    function testDepositWithUsedPermit(address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 0 );
+
+		uint256 depositor_sk = uint256(keccak256(abi.encodePacked("depositor")));
+		address depositor = vm.addr(depositor_sk);
+		PToken token = permitToken(depositor, amount);
+		uint256 deadline = block.timestamp + 600;
+		(uint8 v, bytes32 r, bytes32 s) = signPermit(token, depositor_sk, address(source), amount, deadline);
+
+		// Someone submits the permit from the mempool first, the deposit still goes through
+		token.permit( depositor, address(source), amount, deadline, v, r, s );
+		vm.prank(depositor);
+		source.depositWithPermit( address(token), recipient, amount, deadline, v, r, s );
+
+		assertEq( amount, token.balanceOf(address(source)) );
+    }
+
+    function testDepositWithInvalidPermit(address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 0 );
+
+		uint256 depositor_sk = uint256(keccak256(abi.encodePacked("depositor")));
+		address depositor = vm.addr(depositor_sk);
+		PToken token = permitToken(depositor, amount);
+		uint256 deadline = block.timestamp + 600;
+		// Signed for a smaller amount than the one deposited
+		(uint8 v, bytes32 r, bytes32 s) = signPermit(token, depositor_sk, address(source), amount - 1, deadline);
+
+		vm.prank(depositor);
+		vm.expectRevert();
+		source.depositWithPermit( address(token), recipient, amount, deadline, v, r, s );
+    }
+
+    function testDepositWithExpiredPermit(address recipient, uint256 amount) public {
+		vm.assume( recipient != address(0) );
+		vm.assume( amount < 1<<250 );
+		vm.assume( amount > 0 );
+
+		uint256 depositor_sk = uint256(keccak256(abi.encodePacked("depositor")));
+		address depositor = vm.addr(depositor_sk);
+		PToken token = permitToken(depositor, amount);
+		vm.warp(1000);
+		uint256 deadline = block.timestamp - 1;
+		(uint8 v, bytes32 r, bytes32 s) = signPermit(token, depositor_sk, address(source), amount, deadline);
+
+		vm.prank(depositor);
+		vm.expectRevert();
+		source.depositWithPermit( address(token), recipient, amount, deadline, v, r, s );
+    }
 }
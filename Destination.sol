@@ -23,6 +23,19 @@ contract Destination is AccessControl {
     }
 
 	function wrap(address _underlying_token, address _recipient, uint256 _amount) public onlyRole(WARDEN_ROLE) {
+		_wrap(_underlying_token, _recipient, _amount);
+	}
+
+	function wrapBatch(address[] calldata _underlying_tokens, address[] calldata _recipients, uint256[] calldata _amounts) public onlyRole(WARDEN_ROLE) {
+		// Relay several deposits in one transaction, each one still emits its own Wrap event
+		require(_underlying_tokens.length == _recipients.length && _recipients.length == _amounts.length, "Array lengths do not match");
+
+		for( uint256 i = 0; i < _underlying_tokens.length; i++ ) {
+			_wrap(_underlying_tokens[i], _recipients[i], _amounts[i]);
+		}
+	}
+
+	function _wrap(address _underlying_token, address _recipient, uint256 _amount) internal {
 		// Get the wrapped token corresponding to the underlying token
 		address wrapped_token = wrapped_tokens[_underlying_token];
 		
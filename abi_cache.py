@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+
+# ABI entries the relayer uses: the events it scans for and the functions it relays with
+# Role management, views and admin functions are dropped from the cached copy
+RELAYER_ABI_ENTRIES = ('Deposit', 'Unwrap', 'wrap', 'wrapBatch', 'withdraw', 'withdrawBatch')
+
+# Name of the cache file, kept in the same directory as the contract_info files it caches
+ABI_CACHE_FILE = "contract_info_cache.json"
+
+# Keys of a chain's contract info that are never written to the cache: they are read from the contract_info file
+SECRET_KEYS = ('private_key', 'private_keys')
+
+
+def compact(contracts):
+    """
+        contracts - (dictionary) the parsed contract_info file, chain -> {'address', 'abi', ...}
+        Returns the same dictionary with each ABI cut down to RELAYER_ABI_ENTRIES and without the SECRET_KEYS
+    """
+    compacted = {}
+    for chain, info in contracts.items():
+        compacted[chain] = {key: value for key, value in info.items() if key != 'abi' and key not in SECRET_KEYS}
+        compacted[chain]['abi'] = [entry for entry in info.get('abi', []) if entry.get('name') in RELAYER_ABI_ENTRIES]
+    return compacted
+
+
+def secrets(contracts):
+    """
+        Returns the SECRET_KEYS of each chain of a parsed contract_info file (chains without any are left out)
+    """
+    return {chain: {key: info[key] for key in SECRET_KEYS if key in info}
+            for chain, info in contracts.items() if any(key in info for key in SECRET_KEYS)}
+
+
+class ContractInfoCache:
+    """
+        Compact copies of contract_info files, kept in a small JSON file so short-lived relayer runs
+        do not parse and process the full ABIs every time
+        A cached copy is used while its source file keeps the same modification time and size. When those change
+        the file is hashed, and it is only parsed again if its content actually changed
+        The warden keys (SECRET_KEYS) are not cached: when the file has any, they are read from it on every load
+    """
+
+    def __init__(self, path=None):
+        """
+            path - (string) location of the cache file, by default ABI_CACHE_FILE next to each contract_info file
+                   (not in the working directory, which changes with wherever the relayer is started from)
+        """
+        self.path = path
+        self.loaded = {}  # (source path, mtime, size) -> contract info, for this process
+
+    def cache_path(self, source):
+        return self.path if self.path is not None else os.path.join(os.path.dirname(source), ABI_CACHE_FILE)
+
+    def read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, path, entries):
+        # Write to a temporary file first so a concurrent run never reads a half-written cache
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # The cache only saves time, the relayer works without it
+
+    def load(self, contract_info):
+        """
+            contract_info - (string) path of a contract_info file
+            Returns the compact contract info of every chain in the file
+            Raises OSError or ValueError if the file cannot be read or parsed
+        """
+        source = os.path.abspath(contract_info)
+        stat = os.stat(source)
+        key = (source, stat.st_mtime_ns, stat.st_size)
+        if key in self.loaded:
+            return self.loaded[key]
+
+        cache_path = self.cache_path(source)
+        entries = self.read(cache_path)
+        entry = entries.get(source)
+        parsed = None
+        if entry is not None and 'secrets' not in entry:
+            entry = None  # written by a version that cached the keys, replace it
+        if entry is None or (entry['mtime_ns'], entry['size']) != (stat.st_mtime_ns, stat.st_size):
+            with open(source, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            if entry is None or entry['sha256'] != digest:
+                parsed = json.loads(data)
+                entry = {'sha256': digest, 'contracts': compact(parsed), 'secrets': bool(secrets(parsed))}
+            entry['mtime_ns'], entry['size'] = stat.st_mtime_ns, stat.st_size
+            # Forget files that were deleted (e.g. temporary deployments) so the cache does not keep growing
+            entries = {path: cached for path, cached in entries.items()
+                       if os.path.exists(path) and 'secrets' in cached}
+            entries[source] = entry
+            self.write(cache_path, entries)
+
+        contracts = entry['contracts']
+        if entry['secrets']:
+            if parsed is None:
+                with open(source, 'r') as f:
+                    parsed = json.load(f)
+            contracts = {chain: dict(info) for chain, info in contracts.items()}
+            for chain, keys in secrets(parsed).items():
+                contracts.setdefault(chain, {}).update(keys)
+        self.loaded[key] = contracts
+        return contracts
@@ -0,0 +1,99 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from events import TOPICS, decode_log
+
+# Substrings of the errors public endpoints return when an eth_getLogs query spans too many blocks
+# or matches too many logs, e.g. "query returned more than 10000 results" (geth),
+# "exceed maximum block range: 2048" (BSC), "requested too many blocks from 0 to 5000, maximum is set to 2048"
+# (Avalanche), "Log response size exceeded" or "block range is too wide"
+# Rate limiting and transient errors are not range errors: splitting the query would only make more requests,
+# they are retried with a backoff by rpc_pool.RPCPool instead
+RANGE_ERRORS = ("returned more than", "block range", "too many blocks", "maximum is set to", "response size",
+                "max results", "is limited to", "query timeout")
+
+
+def is_range_error(e):
+    message = str(e).lower()
+    return any(marker in message for marker in RANGE_ERRORS)
+
+
+class ChunkedLogScanner:
+    """
+        Fetch the logs of one contract event over a (possibly very large) block range
+        The range is split into chunks that are queried concurrently with eth_getLogs.
+        The chunk size doubles while responses stay small and is halved (and the failing chunk split in two)
+        whenever the endpoint rejects a query for covering too many blocks or returning too many results
+    """
+
+    def __init__(self, w3, contract, event_name, chunk_size=500, min_chunk_size=1, max_chunk_size=5000,
+                 target_logs=1000, workers=4):
+        """
+            w3 - web3 instance connected to the chain the contract lives on
+            contract - (contract object) the contract emitting the events
+            event_name - (string) name of the event to fetch (e.g. "Deposit")
+            chunk_size - (int) number of blocks in the first query
+            min_chunk_size, max_chunk_size - (int) bounds for the adaptive chunk size
+            target_logs - (int) the chunk size only grows while a query returns fewer than half this many logs
+            workers - (int) number of eth_getLogs queries in flight at once
+        """
+        self.w3 = w3
+        self.address = contract.address
+        self.topic = TOPICS[event_name]
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_logs = target_logs
+        self.workers = workers
+
+    def get_logs(self, start_block, end_block):
+        return self.w3.eth.get_logs({'address': self.address,
+                                     'topics': [self.topic],
+                                     'fromBlock': start_block,
+                                     'toBlock': end_block})
+
+    def scan(self, from_block, to_block):
+        """
+            Returns the events emitted between from_block and to_block (inclusive), decoded into
+            events.BridgeEvent records and ordered by block number and log index
+        """
+        logs = []
+        retry = deque()  # chunks that were split after a range error
+        in_flight = {}
+        next_block = from_block
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while retry or in_flight or next_block <= to_block:
+                # Keep every worker busy, retrying split chunks before moving further into the range
+                while len(in_flight) < self.workers and (retry or next_block <= to_block):
+                    if retry:
+                        start_block, end_block = retry.popleft()
+                    else:
+                        start_block = next_block
+                        end_block = min(to_block, start_block + self.chunk_size - 1)
+                        next_block = end_block + 1
+                    future = pool.submit(self.get_logs, start_block, end_block)
+                    in_flight[future] = (start_block, end_block)
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start_block, end_block = in_flight.pop(future)
+                    try:
+                        chunk_logs = future.result()
+                    except Exception as e:
+                        if start_block == end_block or not is_range_error(e):
+                            raise
+                        # Halve the chunk size and query both halves of the failed chunk separately
+                        self.chunk_size = max(self.min_chunk_size, (end_block - start_block + 1) // 2)
+                        middle = (start_block + end_block) // 2
+                        retry.appendleft((middle + 1, end_block))
+                        retry.appendleft((start_block, middle))
+                        continue
+
+                    logs.extend(chunk_logs)
+                    if len(chunk_logs) < self.target_logs // 2:
+                        self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+
+        events = [decode_log(log) for log in logs]
+        events.sort(key=lambda event: (event.block_number, event.log_index))
+        return events
@@ -0,0 +1,313 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Mapping
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from web3 import Web3
+
+import bridge
+from cursor import BlockCursor
+from ledger import RelayLedger, CONFIRMED
+from metrics import RPC_ERRORS, RPC_SECONDS
+
+
+# Where the compiled contracts are read from by default: Foundry's build output (`forge build` in Bridge/)
+DEFAULT_ARTIFACTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Bridge', 'out')
+
+# Functions the relayer batches transfers with, the benchmark warns when the deployed contracts lack them
+BATCH_FUNCTIONS = {'Source': 'withdrawBatch', 'Destination': 'wrapBatch'}
+
+
+def artifact_path(artifacts, name):
+    """
+        Returns the path of a contract's artifact in the artifacts directory: Foundry's <Name>.sol/<Name>.json,
+        or a Remix <Name>.json
+    """
+    for path in (os.path.join(artifacts, f"{name}.sol", f"{name}.json"), os.path.join(artifacts, f"{name}.json")):
+        if os.path.exists(path):
+            return path
+    raise SystemExit(f"No {name} artifact in {artifacts}, build the contracts with `forge build` in Bridge/ "
+                     f"or pass --artifacts")
+
+
+def to_json_rpc(value):
+    """
+        Convert a value returned by web3 (ints, bytes, AttributeDicts) back into its JSON-RPC form
+    """
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, int):
+        return hex(value)
+    if isinstance(value, (bytes, bytearray)):
+        return '0x' + bytes(value).hex()
+    if isinstance(value, Mapping):
+        return {key: to_json_rpc(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_rpc(item) for item in value]
+    return value
+
+
+class LocalNode:
+    """
+        In-process EVM chain (eth-tester) served over JSON-RPC on a local port
+        The relayer talks to it over HTTP exactly as it would to a public endpoint, so every RPC round trip
+        is counted and timed, but nothing leaves the machine
+    """
+
+    def __init__(self):
+        from eth_tester import EthereumTester, PyEVMBackend
+        from eth_tester.backends.pyevm.main import get_default_account_keys
+
+        self.w3 = Web3(Web3.EthereumTesterProvider(EthereumTester(PyEVMBackend())))
+        self.keys = get_default_account_keys()
+        self.lock = threading.Lock()  # eth-tester is not thread safe
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if isinstance(request, list):
+                    response = [node.handle(item) for item in request]
+                else:
+                    response = node.handle(request)
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, request):
+        try:
+            with self.lock:
+                result = self.w3.manager.request_blocking(request['method'], request.get('params', []))
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': to_json_rpc(result)}
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32000, 'message': str(e)}}
+
+    def transact(self, contract_func, sender):
+        with self.lock:
+            tx_hash = contract_func.transact({'from': sender})
+            return self.w3.eth.get_transaction_receipt(tx_hash)
+
+    def deploy(self, artifact, *args):
+        with open(artifact, 'r') as f:
+            compiled = json.load(f)
+        # Foundry artifacts hold the bytecode at the top level, Remix ones under 'data'
+        bytecode = (compiled['bytecode'] if 'bytecode' in compiled else compiled['data']['bytecode'])['object']
+        factory = self.w3.eth.contract(abi=compiled['abi'], bytecode=bytecode)
+        receipt = self.transact(factory.constructor(*args), self.w3.eth.accounts[0])
+        return self.w3.eth.contract(address=receipt.contractAddress, abi=compiled['abi'])
+
+    def close(self):
+        self.server.shutdown()
+
+
+def rpc_requests():
+    """
+        Returns the number of JSON-RPC round trips the relayer has made so far (a batch counts as one)
+    """
+    with RPC_SECONDS.lock:
+        succeeded = sum(series[2] for series in RPC_SECONDS.series.values())
+    with RPC_ERRORS.lock:
+        failed = sum(RPC_ERRORS.series.values())
+    return succeeded + failed
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class BridgeBenchmark:
+    """
+        End to end relay benchmark on two local chains
+        Deploys Source, Destination and a BridgeToken from the compiled artifacts, has a user send N deposits
+        (and then N unwraps) while the relayer runs scan_blocks in a loop, and measures how fast the transfers
+        are relayed
+    """
+
+    def __init__(self, transfers=50, rate=0.0, artifacts=DEFAULT_ARTIFACTS, timeout=600, verbose=False, wardens=1):
+        """
+            transfers - (int) number of deposits, and of unwraps, to relay
+            rate - (float) transfers sent per second while the relayer runs, 0 to send them all up front
+            artifacts - (string) directory holding the Source, Destination and BridgeToken artifacts
+                        (see artifact_path)
+            timeout - (float) seconds after which a phase is stopped even if not every transfer was relayed
+            verbose - (bool) show the relayer's output
+            wardens - (int) number of warden keys the relays are spread over (at most 9)
+        """
+        self.transfers = transfers
+        self.rate = rate
+        self.artifacts = artifacts
+        self.timeout = timeout
+        self.verbose = verbose
+        self.wardens = wardens
+
+    def setup(self):
+        self.workdir = tempfile.mkdtemp(prefix='bridge-benchmark-')
+        self.state_file = os.path.join(self.workdir, 'bridge_state.db')
+        self.contract_info = os.path.join(self.workdir, 'contract_info.json')
+
+        self.source = LocalNode()
+        self.destination = LocalNode()
+        # The first test account deploys the contracts (and so holds every role) and acts as the warden,
+        # the second one is the user sending the transfers
+        admin = self.source.w3.eth.accounts[0]
+        self.user = self.source.w3.eth.accounts[1]
+        artifact = lambda name: artifact_path(self.artifacts, name)
+        for name, function in BATCH_FUNCTIONS.items():
+            with open(artifact(name), 'r') as f:
+                if not any(entry.get('name') == function for entry in json.load(f)['abi']):
+                    print(f"Warning: {artifact(name)} has no {function} function, relays will not be batched. "
+                          f"Rebuild the contracts with `forge build` in Bridge/")
+        self.source_contract = self.source.deploy(artifact('Source'), admin)
+        self.destination_contract = self.destination.deploy(artifact('Destination'), admin)
+        self.token = self.source.deploy(artifact('BridgeToken'), '0x' + '00' * 20, 'Benchmark', 'BENCH', admin)
+        self.source.transact(self.token.functions.mint(self.user, 10 ** 30), admin)
+        self.source.transact(self.token.functions.approve(self.source_contract.address, 10 ** 30), self.user)
+        self.source.transact(self.source_contract.functions.registerToken(self.token.address), admin)
+        self.destination.transact(self.destination_contract.functions.createToken(self.token.address, 'Wrapped',
+                                                                                  'WBENCH'), admin)
+        self.wrapped_token = self.destination_contract.functions.wrapped_tokens(self.token.address).call()
+
+        # Extra wardens are the test accounts after the user's
+        wardens = [0] + list(range(2, self.wardens + 1))
+        for contract, node in ((self.source_contract, self.source), (self.destination_contract, self.destination)):
+            warden_role = contract.functions.WARDEN_ROLE().call()
+            for i in wardens[1:]:
+                node.transact(contract.functions.grantRole(warden_role, node.w3.eth.accounts[i]), admin)
+        warden_keys = [self.source.keys[i].to_hex() for i in wardens]
+        with open(self.contract_info, 'w') as f:
+            json.dump({'source': {'address': self.source_contract.address, 'abi': self.source_contract.abi,
+                                  'private_keys': warden_keys},
+                       'destination': {'address': self.destination_contract.address,
+                                       'abi': self.destination_contract.abi, 'private_keys': warden_keys}}, f)
+
+        # Start scanning right after the setup transactions, the first scan would otherwise only cover the
+        # last few blocks and miss transfers sent up front
+        cursor = BlockCursor(self.state_file)
+        cursor.advance('source', 'Deposit', self.source.w3.eth.block_number)
+        cursor.advance('destination', 'Unwrap', self.destination.w3.eth.block_number)
+        cursor.close()
+
+        # Point the relayer at the local nodes
+        bridge.RPC_URLS['source'] = [self.source.url]
+        bridge.RPC_URLS['destination'] = [self.destination.url]
+        bridge._connections.clear()
+        bridge._contracts.clear()
+
+    def send_transfers(self, node, make_call, sent_at):
+        """
+            Send the transfers from the user, at self.rate per second, recording when each one was mined
+        """
+        for i in range(self.transfers):
+            receipt = node.transact(make_call(i), self.user)
+            sent_at[Web3.to_hex(receipt.transactionHash)] = time.time()
+            if self.rate:
+                time.sleep(1 / self.rate)
+
+    def run_phase(self, chain, node, make_call):
+        """
+            chain - (string) the chain the user sends transfers on
+            Returns the results of relaying self.transfers transfers sent on that chain
+        """
+        sent_at = {}
+        producer = threading.Thread(target=self.send_transfers, args=(node, make_call, sent_at))
+        if not self.rate:
+            producer.run()  # every transfer is already on chain when the relayer starts
+
+        ledger = RelayLedger(self.state_file)
+        requests_before = rpc_requests()
+        start = time.time()
+        if self.rate:
+            producer.start()
+        scans = 0
+        while True:
+            # Local chains do not reorg, relay at the head
+            with contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO()):
+                bridge.scan_blocks(chain, self.contract_info, self.state_file, confirmations=0)
+            scans += 1
+            confirmed = ledger.db.execute("SELECT tx_hash, updated_at, relay_tx_hash FROM relays "
+                                          "WHERE chain = ? AND state = ?", (chain, CONFIRMED)).fetchall()
+            if len(confirmed) >= self.transfers or time.time() - start > self.timeout:
+                break
+        elapsed = time.time() - start
+        if self.rate:
+            producer.join()
+        requests = rpc_requests() - requests_before
+        ledger.close()
+
+        if not confirmed:
+            raise RuntimeError(f"No transfer sent on the {chain} chain was relayed within {self.timeout}s")
+        # Deposit (or unwrap) mined -> relay transaction confirmed, including the time spent waiting for a scan
+        latencies = [confirmed_at - sent_at[tx_hash] for tx_hash, confirmed_at, _ in confirmed if tx_hash in sent_at]
+        return {
+            'transfers': len(confirmed),
+            'seconds': elapsed,
+            'throughput': len(confirmed) / elapsed,
+            'p50_latency': percentile(latencies, 50),
+            'p99_latency': percentile(latencies, 99),
+            'rpc_per_transfer': requests / len(confirmed),
+            # Fewer relay transactions than transfers means the relays were batched
+            'relay_transactions': len({relay_tx_hash for _, _, relay_tx_hash in confirmed}),
+            'scans': scans,
+        }
+
+    def run(self):
+        self.setup()
+        results = {}
+        try:
+            results['deposit -> wrap'] = self.run_phase(
+                'source', self.source,
+                lambda i: self.source_contract.functions.deposit(self.token.address, self.user, 10 ** 18 + i))
+            results['unwrap -> withdraw'] = self.run_phase(
+                'destination', self.destination,
+                lambda i: self.destination_contract.functions.unwrap(self.wrapped_token, self.user, 10 ** 18 + i))
+        finally:
+            self.source.close()
+            self.destination.close()
+        return results
+
+
+def report(results):
+    print(f"{'':20} {'transfers':>9} {'seconds':>8} {'transfers/s':>11} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'RPC/transfer':>12} {'relay txs':>9} {'scans':>6}")
+    for phase, result in results.items():
+        print(f"{phase:20} {result['transfers']:>9} {result['seconds']:>8.2f} {result['throughput']:>11.2f} "
+              f"{result['p50_latency'] * 1000:>8.0f} {result['p99_latency'] * 1000:>8.0f} "
+              f"{result['rpc_per_transfer']:>12.2f} {result['relay_transactions']:>9} {result['scans']:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure relay throughput and latency on two local chains")
+    parser.add_argument("--transfers", type=int, default=50, help="deposits (and unwraps) to relay")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="transfers sent per second while the relayer runs, 0 to send them all up front")
+    parser.add_argument("--artifacts", default=DEFAULT_ARTIFACTS,
+                        help="directory with the compiled contracts: Foundry's out/ (the default, run `forge build` "
+                             "in Bridge/ first) or Remix <Name>.json artifacts")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before giving up on a phase")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the relayer's output")
+    parser.add_argument("--wardens", type=int, default=1, help="warden keys to spread the relays over (at most 9)")
+    args = parser.parse_args()
+    results = BridgeBenchmark(args.transfers, args.rate, args.artifacts, args.timeout, args.verbose,
+                              args.wardens).run()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
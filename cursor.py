@@ -0,0 +1,72 @@
+import sqlite3
+
+STATE_FILE = "bridge_state.db"
+
+
+class BlockCursor:
+    """
+        Checkpointed scan position for each (chain, event) pair
+        The last block that was fully scanned is kept in a small SQLite table so that
+        every call to scan_blocks picks up exactly where the previous one stopped
+    """
+
+    def __init__(self, path=STATE_FILE):
+        """
+            path - (string) location of the SQLite state file
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS cursors ("
+                        "chain TEXT NOT NULL, "
+                        "event TEXT NOT NULL, "
+                        "last_block INTEGER NOT NULL, "
+                        "PRIMARY KEY (chain, event))")
+        self.db.commit()
+
+    def get(self, chain, event):
+        """
+            Returns the last block scanned for this chain/event, or None if it has never been scanned
+        """
+        row = self.db.execute("SELECT last_block FROM cursors WHERE chain = ? AND event = ?",
+                              (chain, event)).fetchone()
+        return None if row is None else row[0]
+
+    def next_range(self, chain, event, latest_block, window=5):
+        """
+            chain - (string) "source" or "destination"
+            event - (string) the event being scanned for (e.g. "Deposit")
+            latest_block - (int) the current head of the chain
+            window - (int) how many blocks to scan the first time a chain is seen
+
+            Returns the (start_block, end_block) range that has not been scanned yet,
+            or None if there are no new blocks
+        """
+        last_block = self.get(chain, event)
+        if last_block is None:
+            start_block = max(0, latest_block - window + 1)
+        else:
+            start_block = last_block + 1
+        if start_block > latest_block:
+            return None
+        return start_block, latest_block
+
+    def advance(self, chain, event, block):
+        """
+            Record that every block up to and including 'block' has been scanned
+        """
+        self.db.execute("INSERT INTO cursors (chain, event, last_block) VALUES (?, ?, ?) "
+                        "ON CONFLICT(chain, event) DO UPDATE SET last_block = excluded.last_block",
+                        (chain, event, block))
+        self.db.commit()
+
+    def rewind(self, chain, event, block):
+        """
+            Move the cursor back so that every block after 'block' is scanned again (e.g. after a reorg)
+            A cursor that is already at or before 'block' is left where it is
+        """
+        self.db.execute("UPDATE cursors SET last_block = ? WHERE chain = ? AND event = ? AND last_block > ?",
+                        (block, chain, event, block))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+
+from web3 import AsyncWeb3, WebSocketProvider
+
+from bridge import RELAY_FUNCTIONS, RPC_URLS, refresh_gas_profiles, scan_blocks
+from cursor import STATE_FILE
+from metrics import METRICS_PORT, serve
+
+WS_URLS = {
+    'source': "wss://api.avax-test.network/ext/bc/C/ws",
+    'destination': None,  # No public WebSocket endpoint for the bsc testnet, new blocks are polled over HTTP
+}
+
+
+def poll_trackers(trackers):
+    """
+        Poll each relay tracker once
+        Returns the trackers that are done (every relay mined, or timed out and left to resolve_in_flight)
+    """
+    done = []
+    for tracker in trackers:
+        try:
+            if not tracker.poll():
+                done.append(tracker)
+        except Exception as e:
+            print(f"Error confirming relays on {tracker.chain} chain: {e}")
+    return done
+
+
+class BridgeDaemon:
+    """
+        Resident relayer: services both bridge directions from one asyncio event loop, scanning each chain as soon
+        as a new block is produced instead of on an external timer
+        New blocks are announced by a newHeads subscription when the chain has a WebSocket endpoint,
+        otherwise (and whenever the subscription is down) the chain's HTTP endpoints are polled with AsyncWeb3.
+        Each chain has a single scanner and a single confirmer, so at most one scan (which decodes the new events
+        and sends their relays, see bridge.scan_blocks) and one receipt check run per chain at a time, each on a
+        worker thread. Blocks that arrive while a scan is running are picked up by one more scan when it finishes,
+        since scan_blocks always covers everything after the last checkpointed block.
+        Scans do not wait for their relays to be mined: each chain's confirmer checks the relays sent on it
+        for receipts (and replaces the stuck ones) every time a new block is announced on that chain
+        The gas profiles of the relay functions are refreshed in the background, so relays are not held up
+        by gas estimates once a profile would go stale
+    """
+
+    def __init__(self, contract_info="contract_info.json", state_file=STATE_FILE, poll_interval=0.5,
+                 reconnect_delay=30.0, ws_urls=WS_URLS, refresh_interval=3600.0):
+        """
+            contract_info - (string) path of the contract_info file
+            state_file - (string) SQLite file holding the block cursors and the relay ledger
+            poll_interval - (float) seconds between block number checks when polling over HTTP
+            reconnect_delay - (float) seconds to wait before reconnecting a WebSocket that failed
+            ws_urls - (dict) WebSocket endpoint of each chain, None to always poll
+            refresh_interval - (float) seconds between checks for gas profiles to refresh
+        """
+        self.contract_info = contract_info
+        self.state_file = state_file
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.ws_urls = ws_urls
+        self.refresh_interval = refresh_interval
+        self.new_block = {chain: asyncio.Event() for chain in ws_urls}
+        self.new_head = {chain: asyncio.Event() for chain in ws_urls}
+        self.trackers = []  # bridge.RelayTracker of the relays sent and not confirmed yet
+        self.subscribed = {chain: False for chain in ws_urls}
+
+    async def scanner(self, chain):
+        """
+            Run scan_blocks (in a worker thread, it is blocking) every time a new block is announced
+        """
+        while True:
+            await self.new_block[chain].wait()
+            self.new_block[chain].clear()
+            try:
+                await asyncio.to_thread(scan_blocks, chain, self.contract_info, self.state_file, None,
+                                        self.trackers)
+            except Exception as e:
+                print(f"Error scanning {chain} chain: {e}")
+
+    async def confirmer(self, chain):
+        """
+            Poll the relays sent on this chain for receipts (in a worker thread) every time a new block is announced
+        """
+        while True:
+            await self.new_head[chain].wait()
+            self.new_head[chain].clear()
+            trackers = [tracker for tracker in self.trackers if tracker.chain == chain]
+            if trackers:
+                for tracker in await asyncio.to_thread(poll_trackers, trackers):
+                    self.trackers.remove(tracker)
+
+    def announce(self, chain):
+        """
+            A new block was produced on the chain: scan it and check it for relay receipts
+        """
+        self.new_block[chain].set()
+        self.new_head[chain].set()
+
+    async def refresh_profiles(self):
+        """
+            Re-estimate the gas profiles that are getting stale every refresh_interval seconds
+        """
+        while True:
+            for chain in RELAY_FUNCTIONS:
+                try:
+                    refreshed = await asyncio.to_thread(refresh_gas_profiles, chain, self.contract_info,
+                                                        self.state_file)
+                    if refreshed:
+                        print(f"Refreshed {refreshed} gas profiles on {chain} chain")
+                except Exception as e:
+                    print(f"Failed to refresh the gas profiles on {chain} chain: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def follow_heads(self, chain):
+        """
+            Announce every block received on the chain's newHeads subscription
+            Returns (or raises) when the WebSocket connection is lost
+        """
+        async with AsyncWeb3(WebSocketProvider(self.ws_urls[chain], max_connection_retries=1)) as w3:
+            await w3.eth.subscribe('newHeads')
+            print(f"Subscribed to new blocks on {chain} chain")
+            self.subscribed[chain] = True
+            # Blocks produced while the subscription was being set up are picked up by this scan
+            self.announce(chain)
+            async for _ in w3.socket.process_subscriptions():
+                self.announce(chain)
+
+    async def poll_heads(self, chain):
+        """
+            Announce new blocks by polling the chain's HTTP endpoints whenever there is no live subscription
+            Every endpoint is asked at once from the event loop, a block is new as soon as one of them has it
+        """
+        # An endpoint that is down fails the poll rather than holding it up with retries, the next poll asks it again
+        endpoints = [AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(url, exception_retry_configuration=None))
+                     for url in RPC_URLS[chain]]
+        last_block = None
+        while True:
+            if self.subscribed[chain]:
+                last_block = None
+                await asyncio.sleep(self.poll_interval)
+                continue
+            results = await asyncio.gather(*(w3.eth.block_number for w3 in endpoints), return_exceptions=True)
+            blocks = [result for result in results if not isinstance(result, BaseException)]
+            if not blocks:
+                print(f"Failed to get the latest block on {chain} chain: {results[0]}")
+            elif max(blocks) != last_block:
+                last_block = max(blocks)
+                self.announce(chain)
+            await asyncio.sleep(self.poll_interval)
+
+    async def subscribe(self, chain):
+        """
+            Keep a newHeads subscription open on the chain, reconnecting after reconnect_delay when it drops
+        """
+        while True:
+            try:
+                await self.follow_heads(chain)
+                print(f"WebSocket connection to {chain} chain closed, polling over HTTP")
+            except Exception as e:
+                print(f"WebSocket subscription on {chain} chain failed, polling over HTTP: {e}")
+            self.subscribed[chain] = False
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def run(self):
+        tasks = [self.refresh_profiles()]
+        for chain, ws_url in self.ws_urls.items():
+            # Catch up on whatever happened while the relayer was not running
+            self.new_block[chain].set()
+            tasks += [self.scanner(chain), self.confirmer(chain), self.poll_heads(chain)]
+            if ws_url:
+                tasks.append(self.subscribe(chain))
+        await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relay bridge events as soon as new blocks are produced")
+    parser.add_argument("--contract-info", default="contract_info.json")
+    parser.add_argument("--state-file", default=STATE_FILE)
+    parser.add_argument("--poll-interval", type=float, default=0.5,
+                        help="seconds between block number checks on chains polled over HTTP")
+    parser.add_argument("--http-only", action="store_true", help="poll every chain over HTTP, no WebSocket")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics, 0 to disable")
+    args = parser.parse_args()
+    if args.metrics_port:
+        serve(args.metrics_port)
+    ws_urls = {chain: None for chain in WS_URLS} if args.http_only else WS_URLS
+    daemon = BridgeDaemon(args.contract_info, args.state_file, args.poll_interval, ws_urls=ws_urls)
+    asyncio.run(daemon.run())
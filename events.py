@@ -0,0 +1,163 @@
+from functools import lru_cache
+
+from eth_utils import keccak, to_checksum_address
+
+
+class BridgeEvent:
+    """
+        Fields shared by every decoded bridge event
+    """
+    __slots__ = ('address', 'block_number', 'log_index', 'transaction_hash')
+    signature = None
+    name = None
+    topic = None
+
+    def __repr__(self):
+        fields = ', '.join(f"{slot}={getattr(self, slot)!r}" for slot in self.fields())
+        return f"{self.name}({fields})"
+
+    @classmethod
+    def fields(cls):
+        return [slot for klass in reversed(cls.__mro__) for slot in getattr(klass, '__slots__', ())]
+
+
+class Deposit(BridgeEvent):
+    __slots__ = ('token', 'recipient', 'amount')
+    signature = "Deposit(address,address,uint256)"
+
+
+class Withdrawal(BridgeEvent):
+    __slots__ = ('token', 'recipient', 'amount')
+    signature = "Withdrawal(address,address,uint256)"
+
+
+class Registration(BridgeEvent):
+    __slots__ = ('token',)
+    signature = "Registration(address)"
+
+
+class Creation(BridgeEvent):
+    __slots__ = ('underlying_token', 'wrapped_token')
+    signature = "Creation(address,address)"
+
+
+class Wrap(BridgeEvent):
+    __slots__ = ('underlying_token', 'wrapped_token', 'to', 'amount')
+    signature = "Wrap(address,address,address,uint256)"
+
+
+class Unwrap(BridgeEvent):
+    __slots__ = ('underlying_token', 'wrapped_token', 'frm', 'to', 'amount')
+    signature = "Unwrap(address,address,address,address,uint256)"
+
+
+EVENTS = (Deposit, Withdrawal, Registration, Creation, Wrap, Unwrap)
+
+# Topic hashes are computed once at import
+for event_class in EVENTS:
+    event_class.name = event_class.__name__
+    event_class.topic = '0x' + keccak(text=event_class.signature).hex()
+
+TOPICS = {event_class.name: event_class.topic for event_class in EVENTS}
+
+
+def to_bytes(value):
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith('0x') else value)
+    return bytes(value)
+
+
+@lru_cache(maxsize=4096)
+def word_to_address(word):
+    """
+        Checksummed address held in the last 20 bytes of a 32 byte word
+        Bridges see the same few tokens and recipients over and over, so the checksums are cached
+    """
+    return to_checksum_address(word[12:])
+
+
+@lru_cache(maxsize=256)
+def checksum_address(address):
+    """
+        Checksummed form of a log's emitting contract address, raw JSON-RPC logs give it in lower case
+    """
+    return to_checksum_address(address)
+
+
+def word_to_int(word):
+    return int.from_bytes(word, 'big')
+
+
+def decode_log(log):
+    """
+        log - a log returned by eth_getLogs (web3 formatted or raw JSON-RPC)
+        Returns the decoded bridge event, or None if the log is not one of the bridge events
+        The indexed arguments are read straight from the topics and the others from the 32 byte data words,
+        without going through web3's ABI codec
+    """
+    topics = log['topics']
+    decoder = DECODERS.get(topics[0].lower() if isinstance(topics[0], str) else '0x' + bytes(topics[0]).hex())
+    if decoder is None:
+        return None
+    event_class, decode = decoder
+    record = event_class.__new__(event_class)
+    decode(record, [to_bytes(topic) for topic in topics[1:]], to_bytes(log['data']))
+    record.address = checksum_address(log['address'])
+    record.block_number = log['blockNumber'] if isinstance(log['blockNumber'], int) else int(log['blockNumber'], 16)
+    record.log_index = log['logIndex'] if isinstance(log['logIndex'], int) else int(log['logIndex'], 16)
+    transaction_hash = log['transactionHash']
+    if not isinstance(transaction_hash, str):
+        transaction_hash = '0x' + bytes(transaction_hash).hex()
+    record.transaction_hash = transaction_hash
+    return record
+
+
+def _transfer(record, topics, data):
+    # Deposit / Withdrawal: token and recipient are indexed, amount is the only data word
+    record.token = word_to_address(topics[0])
+    record.recipient = word_to_address(topics[1])
+    record.amount = word_to_int(data[0:32])
+
+
+def _registration(record, topics, data):
+    record.token = word_to_address(topics[0])
+
+
+def _creation(record, topics, data):
+    record.underlying_token = word_to_address(topics[0])
+    record.wrapped_token = word_to_address(topics[1])
+
+
+def _wrap(record, topics, data):
+    record.underlying_token = word_to_address(topics[0])
+    record.wrapped_token = word_to_address(topics[1])
+    record.to = word_to_address(topics[2])
+    record.amount = word_to_int(data[0:32])
+
+
+def _unwrap(record, topics, data):
+    # 'frm' is the only unindexed address, it comes before amount in the data
+    record.underlying_token = word_to_address(topics[0])
+    record.wrapped_token = word_to_address(topics[1])
+    record.to = word_to_address(topics[2])
+    record.frm = word_to_address(data[0:32])
+    record.amount = word_to_int(data[32:64])
+
+
+DECODERS = {
+    Deposit.topic: (Deposit, _transfer),
+    Withdrawal.topic: (Withdrawal, _transfer),
+    Registration.topic: (Registration, _registration),
+    Creation.topic: (Creation, _creation),
+    Wrap.topic: (Wrap, _wrap),
+    Unwrap.topic: (Unwrap, _unwrap),
+}
+
+
+def relay_args(event):
+    """
+        Returns the (token, recipient, amount) arguments of the relay call for a Deposit or Unwrap event
+    """
+    if isinstance(event, Deposit):
+        return event.token, event.recipient, event.amount
+    return event.underlying_token, event.to, event.amount
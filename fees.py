@@ -0,0 +1,93 @@
+import math
+
+from rpc_batch import batch_request, to_int
+
+# Percentile of recent priority fees (tips) paid for each urgency tier
+URGENCY_PERCENTILES = {
+    'low': 10,
+    'normal': 50,
+    'high': 90,
+}
+
+# Blocks of eth_feeHistory the tips are taken from
+FEE_HISTORY_BLOCKS = 10
+
+# The base fee can rise 12.5% per block, maxFeePerGas allows for it doubling before the transaction is mined
+BASE_FEE_MULTIPLIER = 2
+
+# Nodes only accept a transaction replacing one with the same nonce if it pays at least 10% more
+REPLACEMENT_BUMP = 1.125
+
+
+def fee_history_request():
+    """
+        Returns the (method, params) of the eth_feeHistory request suggest_fees needs, to send in a batch
+    """
+    return 'eth_feeHistory', [hex(FEE_HISTORY_BLOCKS), 'latest', list(URGENCY_PERCENTILES.values())]
+
+
+def suggest_fees(fee_history, gas_price, urgency='normal'):
+    """
+        fee_history - (dict) eth_feeHistory result for fee_history_request(), None if the request failed
+        gas_price - (int) the node's eth_gasPrice
+        urgency - (string) one of URGENCY_PERCENTILES
+
+        Returns the fee fields of a transaction: 'maxFeePerGas' and 'maxPriorityFeePerGas' on chains with
+        a base fee, 'gasPrice' on chains (or nodes) without EIP-1559 support
+        The tip is the urgency's percentile of the tips paid in recent blocks (ignoring empty blocks),
+        and never less than the tip implied by eth_gasPrice
+    """
+    if not fee_history or not fee_history.get('baseFeePerGas'):
+        return {'gasPrice': gas_price}
+    # The last base fee is the one of the next block
+    base_fee = to_int(fee_history['baseFeePerGas'][-1])
+    column = list(URGENCY_PERCENTILES).index(urgency)
+    tips = sorted(to_int(rewards[column]) for rewards, ratio in zip(fee_history.get('reward') or [],
+                                                                     fee_history['gasUsedRatio']) if ratio > 0)
+    tip = max(tips[len(tips) // 2] if tips else 0, gas_price - base_fee, 0)
+    return {'maxFeePerGas': BASE_FEE_MULTIPLIER * base_fee + tip, 'maxPriorityFeePerGas': tip}
+
+
+def fetch_fees(w3, urgency='normal'):
+    """
+        Returns the fee fields for this urgency (see suggest_fees), fetched with one batched request
+    """
+    results = batch_request(w3, [('eth_gasPrice', []), fee_history_request()])
+    if results is None:
+        gas_price = w3.eth.gas_price
+        try:
+            fee_history = w3.eth.fee_history(FEE_HISTORY_BLOCKS, 'latest', list(URGENCY_PERCENTILES.values()))
+        except Exception:
+            fee_history = None
+    else:
+        if isinstance(results[0], Exception):
+            raise results[0]
+        gas_price = to_int(results[0])
+        fee_history = None if isinstance(results[1], Exception) else results[1]
+    return suggest_fees(fee_history, gas_price, urgency)
+
+
+def bump_fees(tx, factor=REPLACEMENT_BUMP):
+    """
+        Returns the fee fields of tx raised enough for a node to accept a replacement with the same nonce
+    """
+    if 'gasPrice' in tx:
+        return {'gasPrice': math.ceil(tx['gasPrice'] * factor)}
+    return {'maxFeePerGas': math.ceil(tx['maxFeePerGas'] * factor),
+            'maxPriorityFeePerGas': math.ceil(tx['maxPriorityFeePerGas'] * factor)}
+
+
+def replacement_fees(w3, tx, urgency='high'):
+    """
+        w3 - web3 instance connected to the chain tx was sent on
+        tx - (dict) the transaction that is not getting mined
+
+        Returns the fee fields for a transaction replacing tx: at least the bumped fees of tx, and the current
+        fees of the urgency tier if the market has moved further
+    """
+    bumped = bump_fees(tx)
+    current = fetch_fees(w3, urgency)
+    if current.keys() != bumped.keys():
+        # Keep the transaction type of the original
+        return bumped
+    return {field: max(bumped[field], current[field]) for field in bumped}
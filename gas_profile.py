@@ -0,0 +1,128 @@
+import argparse
+import math
+import sqlite3
+import time
+
+from cursor import STATE_FILE
+
+# Profiles that apply to every token of a function (e.g. seeded from a Foundry gas report) use this token key
+ANY_TOKEN = ''
+
+# Which chain each bridge contract in a Foundry gas report is deployed on
+REPORT_CONTRACTS = {'Source': 'source', 'Destination': 'destination'}
+
+# Foundry reports the gas used inside the call, a transaction also pays the 21000 base cost
+# and up to 16 gas per calldata byte (selector + three 32 byte arguments for wrap/withdraw)
+TX_OVERHEAD = 21000 + 16 * (4 + 3 * 32)
+
+
+class GasProfiles:
+    """
+        Gas used by the bridge functions, per (chain, function, token)
+        wrap/withdraw use nearly the same gas every time for a given token, so once a profile is known the relayer
+        sets the gas limit from it (plus a safety margin) instead of calling eth_estimateGas for every relay.
+        Profiles are seeded from Foundry gas reports and kept up to date from the receipts of confirmed relays
+        and from estimates (see bridge.refresh_gas_profiles, which the daemon runs in the background);
+        a profile that has not been refreshed for max_age seconds is ignored so the next relay is estimated again
+    """
+
+    def __init__(self, path=STATE_FILE, margin=1.2, max_age=24 * 3600):
+        """
+            path - (string) SQLite state file (shared with the block cursor)
+            margin - (float) the gas limit is the profiled gas multiplied by this factor
+            max_age - (float) seconds after which a profile is considered stale
+        """
+        self.path = path
+        self.margin = margin
+        self.max_age = max_age
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS gas_profiles ("
+                        "chain TEXT NOT NULL, "
+                        "function TEXT NOT NULL, "
+                        "token TEXT NOT NULL, "
+                        "gas INTEGER NOT NULL, "
+                        "updated_at REAL NOT NULL, "
+                        "PRIMARY KEY (chain, function, token))")
+        self.db.commit()
+
+    def gas_limit(self, chain, function, token=ANY_TOKEN):
+        """
+            Returns the gas limit to use for this call, or None if there is no fresh profile for it
+            The limit covers the larger of the token's profile and the whole function's, so a token that was
+            only seen relayed to known recipients still gets room for a first relay to a new one
+        """
+        rows = self.db.execute("SELECT gas FROM gas_profiles "
+                               "WHERE chain = ? AND function = ? AND token IN (?, ?) AND updated_at > ?",
+                               (chain, function, token, ANY_TOKEN, time.time() - self.max_age)).fetchall()
+        if not rows:
+            return None
+        return math.ceil(max(row[0] for row in rows) * self.margin)
+
+    def record(self, chain, function, token, gas):
+        """
+            Record the gas a call used (or was estimated to use), for the token and for the function as a whole
+            Profiles only grow: the limit must cover the most expensive case seen (e.g. minting to an address
+            with no balance yet), a cheaper relay to a known recipient says nothing about the next new one.
+            Recording refreshes a stale profile
+        """
+        now = time.time()
+        self.db.executemany("INSERT INTO gas_profiles (chain, function, token, gas, updated_at) "
+                            "VALUES (?, ?, ?, ?, ?) "
+                            "ON CONFLICT(chain, function, token) DO UPDATE SET "
+                            "gas = MAX(gas_profiles.gas, excluded.gas), updated_at = excluded.updated_at",
+                            [(chain, function, key, gas, now) for key in {token, ANY_TOKEN}])
+        self.db.commit()
+
+    def forget(self, chain, function, token):
+        """
+            Drop the profiles behind a relay that ran out of gas, so the next relays are estimated again
+        """
+        self.db.execute("DELETE FROM gas_profiles WHERE chain = ? AND function = ? AND token IN (?, ?)",
+                        (chain, function, token, ANY_TOKEN))
+        self.db.commit()
+
+    def expiring(self, chain, function, age):
+        """
+            Returns the tokens whose profile for this function was last refreshed more than 'age' seconds ago
+        """
+        rows = self.db.execute("SELECT token FROM gas_profiles "
+                               "WHERE chain = ? AND function = ? AND token != ? AND updated_at < ?",
+                               (chain, function, ANY_TOKEN, time.time() - age)).fetchall()
+        return [row[0] for row in rows]
+
+    def seed_from_gas_report(self, report_file):
+        """
+            report_file - (string) output of `forge test --gas-report` run in Bridge/
+            Record the max gas of every Source and Destination function as the profile for all tokens
+            Returns the number of profiles recorded
+        """
+        seeded = 0
+        chain = None
+        with open(report_file, 'r') as f:
+            for line in f:
+                cells = [cell.strip() for cell in line.replace('│', '|').strip().strip('|').split('|')]
+                if not cells or not cells[0]:
+                    continue
+                if cells[0].endswith(' contract'):
+                    # e.g. "src/Destination.sol:Destination contract"
+                    contract_name = cells[0][:-len(' contract')].split(':')[-1]
+                    chain = REPORT_CONTRACTS.get(contract_name)
+                    continue
+                # Function rows are: name | min | avg | median | max | # calls
+                if chain is not None and len(cells) >= 6 and cells[4].isdigit():
+                    self.record(chain, cells[0], ANY_TOKEN, int(cells[4]) + TX_OVERHEAD)
+                    seeded += 1
+        return seeded
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the relayer's gas profiles from a Foundry gas report")
+    parser.add_argument("report", help="output of `forge test --gas-report`")
+    parser.add_argument("--state-file", default=STATE_FILE)
+    args = parser.parse_args()
+    profiles = GasProfiles(args.state_file)
+    print(f"Seeded {profiles.seed_from_gas_report(args.report)} gas profiles from {args.report}")
+    profiles.close()
@@ -0,0 +1,296 @@
+import json
+import sqlite3
+import time
+
+from cursor import STATE_FILE
+
+# A relay moves discovered -> submitted -> confirmed (or failed if the relay transaction reverted, or its gas
+# estimate showed it would revert)
+# A submitted relay whose transaction was rejected, dropped from the mempool or ran out of gas goes back to
+# discovered, and so does a failed relay (up to a number of attempts, see retry_failed)
+DISCOVERED = 'discovered'
+SUBMITTED = 'submitted'
+CONFIRMED = 'confirmed'
+FAILED = 'failed'
+
+
+class RelayLedger:
+    """
+        Durable record of every bridge event the relayer has seen and what happened to its relay
+        Events are keyed by (chain, tx hash, log index) of the log that triggered them, so rescanning the same
+        blocks never relays a transfer twice, and after a crash the relayer knows which relays are still to be
+        sent and which ones were in flight. An event is also identified by its position among the transaction's
+        bridge events, which does not change when a reorg includes the transaction again in another block
+    """
+
+    def __init__(self, path=STATE_FILE):
+        """
+            path - (string) SQLite state file (shared with the block cursor)
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS relays ("
+                        "chain TEXT NOT NULL, "
+                        "tx_hash TEXT NOT NULL, "
+                        "log_index INTEGER NOT NULL, "
+                        "block_number INTEGER NOT NULL, "
+                        "token TEXT NOT NULL, "
+                        "recipient TEXT NOT NULL, "
+                        "amount TEXT NOT NULL, "  # uint256 does not fit in an SQLite integer
+                        "state TEXT NOT NULL, "
+                        "relay_tx_hash TEXT, "
+                        "updated_at REAL NOT NULL, "
+                        "attempts INTEGER NOT NULL DEFAULT 0, "  # relay transactions that reverted
+                        "tx_position INTEGER, "  # position among the bridge events of the transaction
+                        "PRIMARY KEY (chain, tx_hash, log_index))")
+        # State files written by earlier versions lack the newer columns
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(relays)")]
+        if 'attempts' not in columns:
+            self.db.execute("ALTER TABLE relays ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        if 'tx_position' not in columns:
+            self.db.execute("ALTER TABLE relays ADD COLUMN tx_position INTEGER")
+            self.db.execute("UPDATE relays SET tx_position = (SELECT COUNT(*) FROM relays AS earlier "
+                            "WHERE earlier.chain = relays.chain AND earlier.tx_hash = relays.tx_hash "
+                            "AND earlier.log_index < relays.log_index)")
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS relays_tx_position ON relays (chain, tx_hash, tx_position)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS relays_state ON relays (chain, state)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS relays_relay_tx_hash ON relays (relay_tx_hash)")
+        # Relay transactions that were resent with the same nonce and a higher fee, and the latest replacement
+        # sent for each of them. Either one can end up being mined
+        self.db.execute("CREATE TABLE IF NOT EXISTS replaced_relays ("
+                        "tx_hash TEXT PRIMARY KEY, "
+                        "relay_tx_hash TEXT NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS replaced_relays_relay_tx_hash "
+                        "ON replaced_relays (relay_tx_hash)")
+        # Sender and nonce of every relay transaction, so a transaction that is not known to the node any more
+        # can be told apart from one that is still waiting to be mined, and its fields so it can be resent at
+        # a higher fee by a later run
+        self.db.execute("CREATE TABLE IF NOT EXISTS relay_transactions ("
+                        "tx_hash TEXT PRIMARY KEY, "
+                        "sender TEXT NOT NULL, "
+                        "nonce INTEGER NOT NULL, "
+                        "dropped_since INTEGER, "  # first block at which the transaction looked dropped
+                        "tx TEXT, "  # JSON transaction fields, as signed
+                        "waiting_since INTEGER)")  # first block at which it was seen waiting for its nonce
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(relay_transactions)")]
+        for column in ('dropped_since INTEGER', 'tx TEXT', 'waiting_since INTEGER'):
+            if column.split()[0] not in columns:
+                self.db.execute(f"ALTER TABLE relay_transactions ADD COLUMN {column}")
+        self.db.commit()
+
+    def discover(self, chain, events, relay_args):
+        """
+            chain - (string) the chain the events were emitted on
+            events - (list of events.BridgeEvent) Deposit or Unwrap events
+            relay_args - function returning the (token, recipient, amount) relay arguments of an event
+            Record new events, events that are already in the ledger keep their current state
+            The events must cover whole blocks, so every bridge event of a transaction is in the list
+        """
+        now = time.time()
+        positions = {}
+        rows = []
+        for event in sorted(events, key=lambda event: (event.block_number, event.log_index)):
+            position = positions.get(event.transaction_hash, 0)
+            positions[event.transaction_hash] = position + 1
+            token, recipient, amount = relay_args(event)
+            rows.append((chain, event.transaction_hash, event.log_index, position, event.block_number,
+                         token, recipient, str(amount), DISCOVERED, now))
+        # A transaction included again in another block after a reorg emits the same events at other log indices,
+        # they are the events already recorded at the same position in the transaction: only their block moves
+        self.db.executemany("UPDATE relays SET block_number = ? WHERE chain = ? AND tx_hash = ? AND tx_position = ?",
+                            [(row[4], row[0], row[1], row[3]) for row in rows])
+        self.db.executemany("INSERT OR IGNORE INTO relays (chain, tx_hash, log_index, tx_position, block_number, "
+                            "token, recipient, amount, state, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    def pending(self, chain):
+        """
+            Returns the keys and the (token, recipient, amount) relay arguments of every event on this chain
+            that has not been relayed yet, in the order the events were emitted
+        """
+        rows = self.db.execute("SELECT tx_hash, log_index, token, recipient, amount FROM relays "
+                               "WHERE chain = ? AND state = ? ORDER BY block_number, log_index",
+                               (chain, DISCOVERED)).fetchall()
+        keys = [(chain, tx_hash, log_index) for tx_hash, log_index, _, _, _ in rows]
+        calls = [(token, recipient, int(amount)) for _, _, token, recipient, amount in rows]
+        return keys, calls
+
+    def in_flight(self, chain):
+        """
+            Returns the hashes of the relay transactions for events on this chain that were sent
+            but not confirmed yet, including the transactions that were replaced
+        """
+        rows = self.db.execute("SELECT relay_tx_hash FROM relays WHERE chain = ? AND state = ? "
+                               "UNION SELECT replaced_relays.tx_hash FROM replaced_relays JOIN relays "
+                               "ON relays.relay_tx_hash = replaced_relays.relay_tx_hash "
+                               "WHERE relays.chain = ? AND relays.state = ?",
+                               (chain, SUBMITTED, chain, SUBMITTED)).fetchall()
+        return [row[0] for row in rows]
+
+    def submit(self, keys, relay_tx_hash, sender, nonce, tx=None):
+        """
+            keys - (list of tuples) the (chain, tx hash, log index) of the events
+            tx - (dict) the fields of the relay transaction, kept so it can be replaced at a higher fee
+            Record the relay transaction of these events before it is sent
+        """
+        self.db.execute("INSERT OR REPLACE INTO relay_transactions (tx_hash, sender, nonce, tx) VALUES (?, ?, ?, ?)",
+                        (relay_tx_hash, sender, nonce, None if tx is None else json.dumps(tx)))
+        self.set_state(keys, SUBMITTED, relay_tx_hash)
+
+    def unconfirmed(self, chain):
+        """
+            Returns the (hash, sender, nonce) of the latest relay transaction of every event on this chain that
+            was sent but not confirmed yet, for the transactions whose nonce is known
+        """
+        return self.db.execute("SELECT DISTINCT relays.relay_tx_hash, sender, nonce FROM relays "
+                               "JOIN relay_transactions ON relay_transactions.tx_hash = relays.relay_tx_hash "
+                               "WHERE chain = ? AND state = ?", (chain, SUBMITTED)).fetchall()
+
+    def relay_hashes(self, relay_tx_hash):
+        """
+            Returns the hash of a relay transaction followed by the hashes of the transactions it replaced
+        """
+        rows = self.db.execute("SELECT tx_hash FROM replaced_relays WHERE relay_tx_hash = ?",
+                               (relay_tx_hash,)).fetchall()
+        return [relay_tx_hash] + [row[0] for row in rows]
+
+    def transaction(self, relay_tx_hash):
+        """
+            Returns the fields of a relay transaction as it was signed, or None if they were not recorded
+        """
+        row = self.db.execute("SELECT tx FROM relay_transactions WHERE tx_hash = ?", (relay_tx_hash,)).fetchone()
+        return None if row is None or row[0] is None else json.loads(row[0])
+
+    def dropped_since(self, dropped, block):
+        """
+            dropped - (dict) hash -> whether the relay transaction looks dropped at 'block'
+            Returns the block since which each relay transaction that looks dropped has looked dropped,
+            a transaction that stops looking dropped starts over the next time it does
+        """
+        return self._since('dropped_since', dropped, block)
+
+    def waiting_since(self, waiting, block):
+        """
+            waiting - (dict) hash -> whether the relay transaction is still waiting for its nonce at 'block'
+            Returns the block since which each waiting relay transaction has been seen waiting
+        """
+        return self._since('waiting_since', waiting, block)
+
+    def _since(self, column, flags, block):
+        """
+            Record in 'column' the first block of the current streak of each relay transaction whose flag is set,
+            clear it for the others, and return it for the flagged ones
+        """
+        self.db.executemany(f"UPDATE relay_transactions SET {column} = NULL WHERE tx_hash = ? AND {column} IS NOT NULL",
+                            [(tx_hash,) for tx_hash, flag in flags.items() if not flag])
+        self.db.executemany(f"UPDATE relay_transactions SET {column} = ? WHERE tx_hash = ? AND {column} IS NULL",
+                            [(block, tx_hash) for tx_hash, flag in flags.items() if flag])
+        self.db.commit()
+        since = {}
+        for tx_hash in [tx_hash for tx_hash, flag in flags.items() if flag]:
+            row = self.db.execute(f"SELECT {column} FROM relay_transactions WHERE tx_hash = ?", (tx_hash,)).fetchone()
+            if row is not None:
+                since[tx_hash] = row[0]
+        return since
+
+    def set_state(self, keys, state, relay_tx_hash=None):
+        """
+            keys - (list of tuples) the (chain, tx hash, log index) of the events
+            Move events to a new state, recording the relay transaction when one is given
+        """
+        now = time.time()
+        self.db.executemany("UPDATE relays SET state = ?, relay_tx_hash = COALESCE(?, relay_tx_hash), updated_at = ? "
+                            "WHERE chain = ? AND tx_hash = ? AND log_index = ?",
+                            [(state, relay_tx_hash, now, chain, tx_hash, log_index)
+                             for chain, tx_hash, log_index in keys])
+        self.db.commit()
+
+    def fail(self, keys):
+        """
+            keys - (list of tuples) the (chain, tx hash, log index) of the events
+            Record that the relay of these events would revert (its gas estimate failed) so it was not sent,
+            it counts as an attempt like a relay transaction that reverted (see retry_failed)
+        """
+        now = time.time()
+        self.db.executemany("UPDATE relays SET state = ?, updated_at = ?, attempts = attempts + 1 "
+                            "WHERE chain = ? AND tx_hash = ? AND log_index = ? AND state = ?",
+                            [(FAILED, now, chain, tx_hash, log_index, DISCOVERED)
+                             for chain, tx_hash, log_index in keys])
+        self.db.commit()
+
+    def replace(self, relay_tx_hash, new_relay_tx_hash, tx=None):
+        """
+            tx - (dict) the fields of the replacement
+            Record that a relay transaction was resent with the same nonce and a higher fee
+        """
+        self.db.execute("INSERT OR IGNORE INTO relay_transactions (tx_hash, sender, nonce, tx) "
+                        "SELECT ?, sender, nonce, COALESCE(?, tx) FROM relay_transactions WHERE tx_hash = ?",
+                        (new_relay_tx_hash, None if tx is None else json.dumps(tx), relay_tx_hash))
+        self.db.execute("UPDATE replaced_relays SET relay_tx_hash = ? WHERE relay_tx_hash = ?",
+                        (new_relay_tx_hash, relay_tx_hash))
+        self.db.execute("INSERT OR REPLACE INTO replaced_relays (tx_hash, relay_tx_hash) VALUES (?, ?)",
+                        (relay_tx_hash, new_relay_tx_hash))
+        self.db.execute("UPDATE relays SET relay_tx_hash = ?, updated_at = ? WHERE relay_tx_hash = ? AND state = ?",
+                        (new_relay_tx_hash, time.time(), relay_tx_hash, SUBMITTED))
+        self.db.commit()
+
+    def resolve(self, relay_tx_hash, success):
+        """
+            Mark every event relayed by this transaction (or by a transaction it replaced or was replaced by)
+            as confirmed, or failed if the transaction reverted
+        """
+        row = self.db.execute("SELECT relay_tx_hash FROM replaced_relays WHERE tx_hash = ?",
+                              (relay_tx_hash,)).fetchone()
+        latest = relay_tx_hash if row is None else row[0]
+        # Keep the hash of the transaction that was actually mined
+        self.db.execute("UPDATE relays SET state = ?, relay_tx_hash = ?, updated_at = ?, attempts = attempts + ? "
+                        "WHERE relay_tx_hash = ? AND state = ?",
+                        (CONFIRMED if success else FAILED, relay_tx_hash, time.time(), 0 if success else 1,
+                         latest, SUBMITTED))
+        self.db.commit()
+
+    def retry_failed(self, chain, max_attempts, delay):
+        """
+            Put the events on this chain whose relay reverted fewer than max_attempts times, the last time
+            more than 'delay' seconds ago, back in the queue. A reverted relay moved no tokens, so it can be
+            sent again once whatever made it revert (e.g. a token with no balance to withdraw) may have changed
+            Returns the number of events requeued
+        """
+        cursor = self.db.execute("UPDATE relays SET state = ?, relay_tx_hash = NULL, updated_at = ? "
+                                 "WHERE chain = ? AND state = ? AND attempts < ? AND updated_at < ?",
+                                 (DISCOVERED, time.time(), chain, FAILED, max_attempts, time.time() - delay))
+        self.db.commit()
+        return cursor.rowcount
+
+    def requeue(self, relay_tx_hash):
+        """
+            Put the events relayed by this transaction (or by a transaction it replaced or was replaced by)
+            back in the queue, e.g. because it was dropped from the mempool or ran out of gas
+            Returns the number of events requeued
+        """
+        row = self.db.execute("SELECT relay_tx_hash FROM replaced_relays WHERE tx_hash = ?",
+                              (relay_tx_hash,)).fetchone()
+        latest = relay_tx_hash if row is None else row[0]
+        cursor = self.db.execute("UPDATE relays SET state = ?, relay_tx_hash = NULL, updated_at = ? "
+                                 "WHERE relay_tx_hash = ? AND state = ?",
+                                 (DISCOVERED, time.time(), latest, SUBMITTED))
+        self.db.commit()
+        return cursor.rowcount
+
+    def invalidate(self, chain, block):
+        """
+            Forget the events emitted on this chain after 'block' that have not been relayed yet,
+            because the blocks they were in were reorged out (they are recorded again if the rescan finds them)
+            Events that were already relayed are kept: if the rescan finds their transaction included again,
+            discover matches them by their position in the transaction and they are not relayed a second time
+            Returns the number of events after 'block' that were already relayed
+        """
+        self.db.execute("DELETE FROM relays WHERE chain = ? AND block_number > ? AND state = ?",
+                        (chain, block, DISCOVERED))
+        self.db.commit()
+        row = self.db.execute("SELECT COUNT(*) FROM relays WHERE chain = ? AND block_number > ?",
+                              (chain, block)).fetchone()
+        return row[0]
+
+    def close(self):
+        self.db.close()
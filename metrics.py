@@ -0,0 +1,161 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets, from a fast local RPC call to a slow confirmation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS_PORT = 9464
+
+
+class Metric:
+    """
+        A metric family with fixed label names; each combination of label values is a separate series
+        Updates are a dictionary lookup and an addition under a lock, so instrumenting hot paths is cheap
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        """
+            name - (string) Prometheus metric name
+            help - (string) description shown in the exposition
+            labels - (tuple of strings) label names, values are passed positionally in the same order
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}
+        REGISTRY.append(self)
+
+    def label_string(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{label}="{value}"' for label, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for values, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{self.label_string(values)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *values, amount=1):
+        with self.lock:
+            self.series[values] = self.series.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *values):
+        with self.lock:
+            self.series[values] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *values):
+        with self.lock:
+            series = self.series.get(values)
+            if series is None:
+                # [count per bucket (the last one is +Inf)], sum, count
+                series = self.series[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *values):
+        """
+            Observe how long the body of a with statement takes
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for values, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{self.label_string(values, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{self.label_string(values)} {total}")
+                lines.append(f"{self.name}_count{self.label_string(values)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    """
+        Returns every metric in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT, host='127.0.0.1'):
+    """
+        Serve the metrics at http://host:port/metrics from a background thread
+        Returns the HTTP server (call shutdown() on it to stop)
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Relay pipeline metrics
+RPC_SECONDS = Histogram("bridge_rpc_request_seconds", "Latency of successful JSON-RPC requests", ("chain", "method"))
+RPC_ERRORS = Counter("bridge_rpc_errors_total", "JSON-RPC requests that failed or were rate limited",
+                     ("chain", "method", "endpoint"))
+RPC_THROTTLE_SECONDS = Histogram("bridge_rpc_throttle_seconds",
+                                 "Time requests waited for their endpoint's rate limit budget", ("chain", "priority"))
+STAGE_SECONDS = Histogram("bridge_stage_seconds", "Time spent in each stage of the relay pipeline",
+                          ("chain", "stage"))
+EVENTS_FOUND = Counter("bridge_events_found_total", "Bridge events found while scanning", ("chain", "event"))
+RELAYS_SENT = Counter("bridge_relays_sent_total", "Relay transactions sent", ("chain", "function"))
+RELAYS_CONFIRMED = Counter("bridge_relays_confirmed_total", "Relay transactions mined, by receipt status",
+                           ("chain", "function", "status"))
+RELAYS_FAILED = Counter("bridge_relays_failed_total", "Relay transactions that could not be sent",
+                        ("chain", "function"))
+RELAYS_REPLACED = Counter("bridge_relays_replaced_total",
+                          "Relay transactions resent with the same nonce and a higher fee", ("chain", "function"))
+RELAYS_PENDING = Gauge("bridge_relays_pending", "Events found on the chain that are not relayed yet", ("chain",))
+CURSOR_LAG = Gauge("bridge_cursor_lag_blocks", "Blocks between the chain head and the last scanned block",
+                   ("chain",))
@@ -0,0 +1,157 @@
+import threading
+
+# Substrings of the errors nodes return when a transaction's nonce is out of step with the chain
+NONCE_ERRORS = ("nonce too low", "nonce too high", "invalid nonce", "replacement transaction underpriced")
+
+# Errors a node returns for a transaction it already has in its mempool: the transaction was sent
+# (e.g. by an earlier attempt that timed out), it must not be signed again with a new nonce
+KNOWN_TX_ERRORS = ("already known", "known transaction", "already imported")
+
+
+def is_nonce_error(e):
+    message = str(e).lower()
+    return any(marker in message for marker in NONCE_ERRORS)
+
+
+def is_known_tx_error(e):
+    message = str(e).lower()
+    return any(marker in message for marker in KNOWN_TX_ERRORS)
+
+
+class NonceManager:
+    """
+        Hands out consecutive nonces for one signer on one chain
+        The starting nonce is read from the chain once, after which nonces are allocated locally so that
+        several transactions can be sent without waiting for the previous one to be mined
+    """
+
+    def __init__(self, w3, address):
+        """
+            w3 - web3 instance connected to the chain the signer sends transactions on
+            address - (address) the signer's address
+        """
+        self.w3 = w3
+        self.address = address
+        self.lock = threading.Lock()
+        self.nonce = None
+
+    def sync(self):
+        """
+            Re-read the next nonce from the chain (including transactions still in the mempool)
+            Call this after a "nonce too low" error, or when an allocated nonce was never used
+        """
+        with self.lock:
+            self.nonce = self.w3.eth.get_transaction_count(self.address, 'pending')
+
+    def seed(self, nonce):
+        """
+            Use a nonce read from the chain elsewhere (e.g. in a batched request) if we have not synced yet
+        """
+        with self.lock:
+            if self.nonce is None:
+                self.nonce = nonce
+
+    def fill_gap(self, pending):
+        """
+            pending - (int) the chain's pending transaction count for this signer
+
+            If the node knows of fewer transactions than we handed out nonces for, a transaction was dropped
+            from the mempool and every later one is stuck behind the gap it left. Move back to the first
+            missing nonce so the next transaction fills it
+            Returns True if there was a gap
+        """
+        with self.lock:
+            if self.nonce is None or pending >= self.nonce:
+                return False
+            self.nonce = pending
+            return True
+
+    def next(self):
+        """
+            Returns the next unused nonce for this signer
+        """
+        with self.lock:
+            if self.nonce is None:
+                self.nonce = self.w3.eth.get_transaction_count(self.address, 'pending')
+            nonce = self.nonce
+            self.nonce += 1
+        return nonce
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_nonce_manager(chain, w3, address):
+    """
+        Returns the process-wide NonceManager for this (chain, signer) pair
+    """
+    with _managers_lock:
+        if (chain, address) not in _managers:
+            _managers[(chain, address)] = NonceManager(w3, address)
+        return _managers[(chain, address)]
+
+
+class Lane:
+    """
+        One warden key and the nonces it hands out
+    """
+
+    def __init__(self, chain, w3, private_key):
+        self.account = w3.eth.account.from_key(private_key)
+        self.nonces = get_nonce_manager(chain, w3, self.account.address)
+        self.load = 0  # transactions sent from this key that are not mined yet
+
+
+class WardenPool:
+    """
+        Several warden keys allowed to relay on the same chain, each one a separate nonce lane
+        A transaction that is slow to be mined (e.g. underpriced) only holds back the later transactions
+        of its own lane, so new relays go to the lanes with the fewest transactions waiting to be mined
+    """
+
+    def __init__(self, chain, w3, private_keys):
+        """
+            chain - (string) the chain the relays are sent on
+            w3 - web3 instance connected to that chain
+            private_keys - (list) the warden keys, every one needs the bridge's warden role
+        """
+        self.lanes = [Lane(chain, w3, private_key) for private_key in private_keys]
+
+    def count_requests(self):
+        """
+            Returns the (address, block tag) transaction counts update_loads needs, so they can be fetched
+            along with other requests
+        """
+        requests = []
+        for lane in self.lanes:
+            requests.append((lane.account.address, 'latest'))
+            requests.append((lane.account.address, 'pending'))
+        return requests
+
+    def update_loads(self, counts):
+        """
+            counts - (list of int) the transaction counts asked for by count_requests, in the same order
+
+            Seed the nonces of the lanes that have not synced yet, resync the lanes with a nonce gap, and set
+            the load of every lane to the number of its transactions (sent by this process or any other)
+            that are not mined yet
+        """
+        counts = iter(counts)
+        for lane in self.lanes:
+            mined, pending = next(counts), next(counts)
+            lane.nonces.seed(pending)
+            if lane.nonces.fill_gap(pending):
+                print(f"Nonce gap for warden {lane.account.address}, resending from nonce {pending}")
+            lane.load = max(0, lane.nonces.nonce - mined)
+
+    def assign(self, count):
+        """
+            Returns the lane to send each of count transactions from, filling the least loaded lanes first
+        """
+        lanes = []
+        for _ in range(count):
+            lane = min(self.lanes, key=lambda lane: lane.load)
+            lane.load += 1
+            lanes.append(lane)
+        return lanes
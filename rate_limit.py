@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+# Priority classes of RPC requests, lower goes first when an endpoint's budget is short:
+# transaction submissions, then the block and log reads that discover new transfers, then everything else
+# (receipts, gas estimates, balance and nonce reads)
+SUBMIT = 0
+SCAN = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {SUBMIT: 'submit', SCAN: 'scan', BACKGROUND: 'background'}
+
+# After a rate limit error the budget is cut by this factor, then grows back by RECOVERY_STEP of the configured
+# rate with every successful request, so a limit that is lower than configured (or shared with other clients)
+# is found instead of being hit over and over. Rate limit errors from requests that were already in flight when the
+# budget was cut do not cut it again within THROTTLE_WINDOW seconds
+THROTTLE_FACTOR = 0.5
+THROTTLE_WINDOW = 1.0
+RECOVERY_STEP = 0.02
+MIN_RATE_FRACTION = 0.1
+
+
+class TokenBucket:
+    """
+        Request budget of one endpoint: 'rate' requests per second on average, with bursts of up to 'burst'
+        Requests waiting for the budget are served by priority class, then in arrival order
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+            rate - (float) requests per second the endpoint allows
+            burst - (int) requests that can be sent at once after a quiet period, defaults to one second's worth
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1.0, float(burst if burst is not None else rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.throttled_at = None
+        self.condition = threading.Condition()
+        self.waiting = []  # heap of (priority, arrival) tickets
+        self.arrivals = itertools.count()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        """
+            True if a request could be sent right away
+        """
+        with self.condition:
+            self.refill(time.monotonic())
+            return not self.waiting and self.tokens >= 1
+
+    def acquire(self, priority=BACKGROUND, cost=1):
+        """
+            priority - (int) SUBMIT, SCAN or BACKGROUND
+            cost - (int) requests being sent, e.g. the size of a JSON-RPC batch
+
+            Block until the budget allows the request, returns the seconds spent waiting
+            A request costing more than the burst waits for a full bucket and leaves it in debt,
+            so large batches still keep to the average rate
+        """
+        start = time.monotonic()
+        needed = min(cost, self.capacity)
+        with self.condition:
+            ticket = (priority, next(self.arrivals))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.refill(now)
+                    if self.waiting[0] == ticket:
+                        if self.tokens >= needed:
+                            self.tokens -= cost
+                            return now - start
+                        self.condition.wait((needed - self.tokens) / self.rate)
+                    else:
+                        # Woken up when the request ahead of this one is served
+                        self.condition.wait()
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def throttle(self):
+        """
+            The endpoint rate limited us: slow down and drop any burst that was saved up
+        """
+        with self.condition:
+            now = time.monotonic()
+            self.refill(now)
+            self.tokens = min(self.tokens, 0.0)
+            if self.throttled_at is None or now - self.throttled_at >= THROTTLE_WINDOW:
+                self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate * THROTTLE_FACTOR)
+                self.throttled_at = now
+
+    def recover(self):
+        with self.condition:
+            if self.rate < self.max_rate:
+                self.refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """
+        Seconds to wait before retry number 'attempt' (starting at 0) of a rate limited request
+        Exponential backoff with full jitter, so clients that were limited together do not all retry together
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,258 @@
+import time
+
+from web3 import Web3
+from web3.datastructures import AttributeDict
+from web3.exceptions import TransactionNotFound
+
+from rpc_batch import RPCError, batch_request, to_int
+
+# Receipt fields returned as hex quantities by JSON-RPC that the relayer reads as integers
+RECEIPT_QUANTITIES = ("status", "blockNumber", "gasUsed", "cumulativeGasUsed", "effectiveGasPrice",
+                      "transactionIndex", "type")
+
+# Substrings of the errors endpoints return for a JSON-RPC method they do not implement
+# (JSON-RPC error -32601, "the method eth_getBlockReceipts does not exist/is not available", ...)
+UNSUPPORTED_ERRORS = ("-32601", "method not found", "does not exist", "not available", "not supported",
+                      "unsupported", "unknown rpc")
+
+
+def is_unsupported_error(e):
+    if isinstance(e, NotImplementedError):
+        return True
+    message = str(e).lower()
+    return any(marker in message for marker in UNSUPPORTED_ERRORS)
+
+
+def to_hex(tx_hash):
+    if isinstance(tx_hash, str):
+        return tx_hash.lower()
+    return Web3.to_hex(tx_hash)
+
+
+def format_receipt(receipt):
+    """
+        Convert a raw JSON-RPC receipt (hex quantities) into an AttributeDict with integer fields
+    """
+    receipt = dict(receipt)
+    for field in RECEIPT_QUANTITIES:
+        if isinstance(receipt.get(field), str):
+            receipt[field] = int(receipt[field], 16)
+    return AttributeDict(receipt)
+
+
+def get_receipts(w3, tx_hashes):
+    """
+        w3 - web3 instance
+        tx_hashes - (list) transaction hashes
+
+        Look up the receipts of several transactions with a single JSON-RPC batch request
+        Providers without batch support fall back to one eth_getTransactionReceipt call per hash
+        Returns a dictionary mapping each hash (as a 0x-prefixed hex string) to its receipt,
+        transactions that have not been mined yet are left out
+    """
+    tx_hashes = [to_hex(tx_hash) for tx_hash in tx_hashes]
+    receipts = {}
+    results = batch_request(w3, [('eth_getTransactionReceipt', [tx_hash]) for tx_hash in tx_hashes])
+    if results is not None:
+        for tx_hash, result in zip(tx_hashes, results):
+            if result and not isinstance(result, Exception):
+                receipts[tx_hash] = format_receipt(result)
+        return receipts
+
+    for tx_hash in tx_hashes:
+        try:
+            receipts[tx_hash] = w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            pass
+    return receipts
+
+
+def get_transaction_status(w3, tx_hashes, senders=()):
+    """
+        w3 - web3 instance
+        tx_hashes - (list) transaction hashes
+        senders - (list) addresses whose mined transaction count ('latest') to read as well
+
+        Read the chain head, the senders' transaction counts, the receipt of each transaction and whether the
+        node knows it at all (eth_getTransactionByHash), with a single JSON-RPC batch so that every answer comes
+        from one endpoint's view of the chain. Providers without batch support make the same requests one at a
+        time through the same provider
+        Returns (head, counts, receipts, known): counts maps each sender to its transaction count, receipts each
+        mined hash (as a 0x-prefixed hex string) to its receipt, and known each hash to True if the node has
+        the transaction (mined or in its mempool) or False if it does not. Senders and hashes whose lookup
+        failed are left out of counts and known
+    """
+    tx_hashes = [to_hex(tx_hash) for tx_hash in tx_hashes]
+    senders = list(senders)
+    requests = [('eth_blockNumber', [])]
+    requests.extend(('eth_getTransactionCount', [sender, 'latest']) for sender in senders)
+    requests.extend(('eth_getTransactionReceipt', [tx_hash]) for tx_hash in tx_hashes)
+    requests.extend(('eth_getTransactionByHash', [tx_hash]) for tx_hash in tx_hashes)
+    results = batch_request(w3, requests)
+    if results is None:
+        results = []
+        for method, params in requests:
+            try:
+                response = w3.provider.make_request(method, params)
+                results.append(RPCError(response['error']) if 'error' in response else response.get('result'))
+            except Exception as e:
+                results.append(e)
+
+    if isinstance(results[0], Exception):
+        raise results[0]
+    head = to_int(results[0])
+    counts = {sender: to_int(result) for sender, result in zip(senders, results[1:1 + len(senders)])
+              if not isinstance(result, Exception)}
+    receipt_results = results[1 + len(senders):1 + len(senders) + len(tx_hashes)]
+    lookup_results = results[1 + len(senders) + len(tx_hashes):]
+    receipts = {tx_hash: format_receipt(result) for tx_hash, result in zip(tx_hashes, receipt_results)
+                if result and not isinstance(result, Exception)}
+    known = {tx_hash: result is not None for tx_hash, result in zip(tx_hashes, lookup_results)
+             if not isinstance(result, Exception)}
+    return head, counts, receipts, known
+
+
+class ConfirmationTracker:
+    """
+        Wait for a set of submitted transactions to be mined
+        Instead of polling each transaction separately, the tracker fetches every receipt of each new block with
+        eth_getBlockReceipts (or looks up all outstanding hashes in one batch when the endpoint does not support it)
+        Transactions that stay unmined for too many blocks can be replaced (same nonce, higher fee), the tracker
+        then waits for whichever of the original and its replacements is mined
+        wait() blocks until every transaction is mined; start() followed by poll() on each new block does the same
+        without blocking the caller in between
+    """
+
+    def __init__(self, w3, poll_interval=1.0, timeout=120, replace_after=None, replace=None):
+        """
+            w3 - web3 instance connected to the chain the transactions were sent on
+            poll_interval - (float) seconds between checks for a new block
+            timeout - (float) seconds to wait before giving up on the remaining transactions
+            replace_after - (int) blocks a transaction may wait before replace is called for it
+            replace - function sending a replacement for a transaction hash, returning the replacement's hash
+                      or None if it could not be replaced (it is tried again replace_after blocks later)
+        """
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.replace_after = replace_after
+        self.replace = replace
+        self.pending = set()
+        self.receipts = {}
+        self.originals = {}  # hash of every tracked transaction -> hash of the first transaction with its nonce
+        self.sent_at = {}  # latest replacement of each transaction -> block it was sent at
+        self.block_receipts = True  # cleared if the endpoint does not support eth_getBlockReceipts
+        self.last_block = None  # last block whose receipts were checked, set by start()
+        self.deadline = None
+
+    def add(self, tx_hash):
+        tx_hash = to_hex(tx_hash)
+        self.pending.add(tx_hash)
+        self.originals[tx_hash] = tx_hash
+
+    def lookup(self):
+        """
+            Fetch the receipts of all pending transactions in one batch
+        """
+        self.record(get_receipts(self.w3, self.pending).values())
+
+    def scan_block(self, block_number):
+        """
+            Fetch every receipt in a block and record the ones we are waiting for
+            Returns False if the receipts could not be fetched: the block is tried again on the next poll after
+            a transient error, and the tracker switches to looking up hashes if the endpoint does not support
+            eth_getBlockReceipts
+        """
+        try:
+            receipts = self.w3.eth.get_block_receipts(block_number)
+        except Exception as e:
+            if is_unsupported_error(e):
+                self.block_receipts = False
+            return False
+        self.record(receipts)
+        return True
+
+    def record(self, receipts):
+        for receipt in receipts:
+            tx_hash = to_hex(receipt['transactionHash'])
+            if tx_hash in self.pending:
+                # Once one transaction with this nonce is mined, the others sharing it never will be
+                original = self.originals[tx_hash]
+                for other in [other for other in self.pending if self.originals[other] == original]:
+                    self.pending.discard(other)
+                    self.sent_at.pop(other, None)
+                self.receipts[tx_hash] = receipt
+
+    def replace_stuck(self, latest_block):
+        """
+            Replace the transactions that have waited replace_after blocks since they (or the transaction
+            they replace) were sent
+        """
+        for tx_hash, sent_at in list(self.sent_at.items()):
+            if latest_block - sent_at < self.replace_after:
+                continue
+            new_hash = self.replace(tx_hash)
+            if new_hash is None:
+                self.sent_at[tx_hash] = latest_block
+                continue
+            new_hash = to_hex(new_hash)
+            del self.sent_at[tx_hash]
+            self.pending.add(new_hash)
+            self.originals[new_hash] = self.originals[tx_hash]
+            self.sent_at[new_hash] = latest_block
+
+    def start(self):
+        """
+            Start tracking the transactions added so far: the ones mined before tracking started are
+            looked up right away, the others are looked for in the blocks produced from now on
+        """
+        self.deadline = time.monotonic() + self.timeout
+        self.last_block = self.w3.eth.block_number
+        if self.replace is not None:
+            self.sent_at = {tx_hash: self.last_block for tx_hash in self.pending}
+        if self.pending:
+            self.lookup()
+
+    def poll(self):
+        """
+            Record the receipts of the blocks produced since the last poll and replace the stuck transactions,
+            without waiting for new blocks
+            Returns True while some transactions are still pending and the timeout has not expired
+        """
+        latest_block = self.w3.eth.block_number
+        if self.pending and latest_block != self.last_block:
+            block_number = self.last_block + 1
+            while self.block_receipts and self.pending and block_number <= latest_block:
+                if not self.scan_block(block_number):
+                    break
+                block_number += 1
+            if not self.block_receipts:
+                self.lookup()
+                block_number = latest_block + 1
+            # Blocks that could not be fetched are scanned again on the next poll
+            self.last_block = block_number - 1
+            if self.replace is not None:
+                self.replace_stuck(latest_block)
+        return bool(self.pending) and time.monotonic() < self.deadline
+
+    def wait(self):
+        """
+            Block until every transaction added to the tracker has been mined, or the timeout expires
+            Returns a dictionary mapping each mined transaction hash to its receipt
+        """
+        self.start()
+        while self.pending and time.monotonic() < self.deadline:
+            time.sleep(self.poll_interval)
+            self.poll()
+        return self.receipts
+
+    def report(self, label):
+        """
+            Print a summary of the tracked transactions
+            label - (string) describes the transactions, e.g. "wrap transaction on destination chain"
+        """
+        for tx_hash, receipt in self.receipts.items():
+            status = "successful" if receipt['status'] else "reverted"
+            print(f"{label} {status}. Hash: {tx_hash}")
+        for tx_hash in self.pending:
+            print(f"{label} not confirmed after {self.timeout} seconds. Hash: {tx_hash}")
@@ -0,0 +1,150 @@
+import argparse
+
+import pandas as pd
+
+# Each direction of the bridge: (chain and event of the transfer, chain and event of its relay)
+DIRECTIONS = {
+    'deposit': (('source', 'Deposit'), ('destination', 'Wrap')),
+    'unwrap': (('destination', 'Unwrap'), ('source', 'Withdrawal')),
+}
+
+# Fields of each event holding the transfer's (token, recipient, amount), the token always being the underlying
+# token on the source chain, so both sides of a direction join without looking up wrapped tokens
+TRANSFER_FIELDS = {
+    'Deposit': ('token', 'recipient', 'amount'),
+    'Wrap': ('underlying_token', 'to', 'amount'),
+    'Unwrap': ('underlying_token', 'to', 'amount'),
+    'Withdrawal': ('token', 'recipient', 'amount'),
+}
+
+# Transfers with the same token, recipient and amount are told apart by their ordinal: the n-th such transfer
+# matches the n-th such relay
+KEY = ['token', 'recipient', 'amount', 'ordinal']
+
+COLUMNS = ['token', 'recipient', 'amount', 'block_number', 'log_index', 'transaction_hash']
+
+
+def transfers_frame(events):
+    """
+        events - (list of events.BridgeEvent) transfers or relays of a single event type
+        Returns a DataFrame with the (token, recipient, amount) of each event, its position on its chain and
+        its ordinal among the events with the same token, recipient and amount
+    """
+    rows = []
+    for event in events:
+        token, recipient, amount = (getattr(event, field) for field in TRANSFER_FIELDS[event.name])
+        rows.append((token, recipient, amount, event.block_number, event.log_index, event.transaction_hash))
+    return index_transfers(pd.DataFrame.from_records(rows, columns=COLUMNS))
+
+
+def index_transfers(frame):
+    """
+        frame - (DataFrame) with at least token, recipient, amount, block_number and log_index columns
+        Returns a copy with normalized keys and the ordinal column, in chain order
+        Amounts are kept as decimal strings since uint256 values do not fit in an int64 column
+    """
+    frame = frame.sort_values(['block_number', 'log_index'], kind='stable').reset_index(drop=True)
+    frame['token'] = frame['token'].astype(str).str.lower()
+    frame['recipient'] = frame['recipient'].astype(str).str.lower()
+    frame['amount'] = frame['amount'].astype(str)
+    frame['ordinal'] = frame.groupby(['token', 'recipient', 'amount'], sort=False).cumcount()
+    return frame
+
+
+class Reconciliation:
+    """
+        Result of matching the transfers of one bridge direction with their relays
+    """
+
+    def __init__(self, transfers, relays):
+        """
+            transfers - (DataFrame) the transfers, see transfers_frame
+            relays - (DataFrame) the relays found on the other chain, see transfers_frame
+        """
+        joined = transfers.merge(relays, on=KEY, how='outer', suffixes=('', '_relay'), indicator=True)
+        self.matched = joined[joined['_merge'] == 'both'].drop(columns='_merge')
+        # Transfers that were never relayed
+        self.unmatched = transfers.merge(joined.loc[joined['_merge'] == 'left_only', KEY], on=KEY)
+        # Relays without a transfer of their own: a second relay of a transfer that was already relayed,
+        # or a relay that matches no transfer at all
+        extra = relays.merge(joined.loc[joined['_merge'] == 'right_only', KEY], on=KEY)
+        relayed = extra[['token', 'recipient', 'amount']].merge(
+            transfers[['token', 'recipient', 'amount']].drop_duplicates(), how='left', indicator=True)['_merge']
+        self.duplicated = extra[(relayed == 'both').to_numpy()]
+        self.unexpected = extra[(relayed == 'left_only').to_numpy()]
+        self.transfers = len(transfers)
+        self.relays = len(relays)
+
+    @property
+    def ok(self):
+        return self.unmatched.empty and self.duplicated.empty and self.unexpected.empty
+
+    def report(self, direction):
+        print(f"{direction}: {self.transfers} transfers, {self.relays} relays, {len(self.matched)} matched, "
+              f"{len(self.unmatched)} not relayed, {len(self.duplicated)} relayed more than once, "
+              f"{len(self.unexpected)} relays without a transfer")
+        for title, frame in (("Not relayed", self.unmatched), ("Relayed more than once", self.duplicated),
+                             ("Relays without a transfer", self.unexpected)):
+            if not frame.empty:
+                print(f"{title}:")
+                print(frame[COLUMNS].to_string(index=False))
+
+
+def reconcile(transfers, relays):
+    """
+        transfers - (list of events.BridgeEvent) e.g. the Deposit events of the source contract
+        relays - (list of events.BridgeEvent) e.g. the Wrap events of the destination contract
+
+        Match every transfer with its relay with a hash join on (token, recipient, amount, ordinal)
+        Returns a Reconciliation
+    """
+    return Reconciliation(transfers_frame(transfers), transfers_frame(relays))
+
+
+def fetch_events(chain, event_name, from_block, to_block, contract_info="contract_info.json"):
+    """
+        Returns the events emitted by the bridge contract on this chain between from_block and to_block
+        (to_block defaults to the latest block)
+    """
+    from backfill import ChunkedLogScanner
+    from bridge import connect_to, get_contract, pinned
+
+    # The latest block and the logs up to it are read from the same endpoint
+    w3 = pinned(connect_to(chain))
+    contract = get_contract(chain, contract_info)
+    if not contract:
+        raise SystemExit(f"Could not load the {chain} contract from {contract_info}")
+    if to_block is None:
+        to_block = w3.eth.block_number
+    return ChunkedLogScanner(w3, contract, event_name).scan(from_block, to_block)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every bridge transfer was relayed exactly once")
+    parser.add_argument("directions", nargs="*", choices=list(DIRECTIONS), default=list(DIRECTIONS),
+                        help="directions to check (default: both)")
+    parser.add_argument("--source-from-block", type=int, required=True, help="first source block to audit")
+    parser.add_argument("--source-to-block", type=int,
+                        help="last source block whose transfers are audited (default: latest), "
+                             "relays are read up to the latest block")
+    parser.add_argument("--destination-from-block", type=int, required=True,
+                        help="first destination block to audit")
+    parser.add_argument("--destination-to-block", type=int,
+                        help="last destination block whose transfers are audited (default: latest), "
+                             "relays are read up to the latest block")
+    parser.add_argument("--contract-info", default="contract_info.json", help="contract info file")
+    args = parser.parse_args()
+    blocks = {'source': (args.source_from_block, args.source_to_block),
+              'destination': (args.destination_from_block, args.destination_to_block)}
+
+    ok = True
+    for direction in args.directions:
+        (transfer_chain, transfer_event), (relay_chain, relay_event) = DIRECTIONS[direction]
+        # Transfers near the end of the range may still be waiting for their relay, the relay chain is audited
+        # up to its latest block so they are not reported as missing
+        relay_from_block, _ = blocks[relay_chain]
+        result = reconcile(fetch_events(transfer_chain, transfer_event, *blocks[transfer_chain], args.contract_info),
+                           fetch_events(relay_chain, relay_event, relay_from_block, None, args.contract_info))
+        result.report(direction)
+        ok = ok and result.ok
+    raise SystemExit(0 if ok else 1)
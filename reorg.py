@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+from collections import deque
+
+from cursor import STATE_FILE
+from receipts import to_hex
+from rpc_batch import batch_request
+
+
+def get_block_hashes(w3, numbers):
+    """
+        w3 - web3 instance
+        numbers - (list of int) block numbers
+
+        Returns a dictionary mapping each block number to its hash (as a lowercase 0x-prefixed string),
+        fetched in a single JSON-RPC batch when the provider supports it
+        Blocks the node does not have (e.g. past a shortened chain's head) are left out
+    """
+    results = batch_request(w3, [('eth_getBlockByNumber', [hex(number), False]) for number in numbers])
+    if results is None:
+        hashes = {}
+        for number in numbers:
+            block = w3.eth.get_block(number)
+            if block is not None:
+                hashes[number] = to_hex(block['hash'])
+        return hashes
+    return {number: result['hash'].lower() for number, result in zip(numbers, results)
+            if result and not isinstance(result, Exception)}
+
+
+class BlockHashRing:
+    """
+        Hashes of the most recent blocks the relayer scanned up to, used to detect reorgs
+        If the newest recorded block still has the same hash, none of the recorded blocks were replaced,
+        so a scan normally costs one extra block lookup. Otherwise every recorded hash is compared to
+        the chain to find the last block that was not reorged out
+        The hashes are kept in the SQLite state file next to the block cursor, so a reorg between two runs of a
+        relayer started by cron is detected too
+    """
+
+    def __init__(self, chain, path=STATE_FILE, size=128):
+        """
+            chain - (string) the chain whose blocks are recorded
+            path - (string) SQLite state file (shared with the block cursor)
+            size - (int) number of recent blocks to remember, reorgs deeper than this are still detected
+            but everything the ring covers is treated as reorged
+        """
+        self.chain = chain
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS block_hashes ("
+                        "chain TEXT NOT NULL, "
+                        "number INTEGER NOT NULL, "
+                        "hash TEXT NOT NULL, "
+                        "PRIMARY KEY (chain, number))")
+        self.db.commit()
+        rows = self.db.execute("SELECT number, hash FROM block_hashes WHERE chain = ? ORDER BY number DESC LIMIT ?",
+                               (chain, size)).fetchall()
+        self.blocks = deque(reversed(rows), maxlen=size)
+        self.lock = threading.Lock()
+
+    def find_fork(self, w3):
+        """
+            Drop the recorded blocks that are no longer on the canonical chain
+            Returns the last recorded block that still is
+        """
+        numbers = [number for number, _ in self.blocks]
+        hashes = get_block_hashes(w3, numbers)
+        # A reorg was seen, so a block that cannot be looked up is rescanned along with the reorged ones
+        while self.blocks and hashes.get(self.blocks[-1][0]) != self.blocks[-1][1]:
+            self.blocks.pop()
+        if self.blocks:
+            return self.blocks[-1][0]
+        return numbers[0] - 1
+
+    def update(self, w3, head):
+        """
+            w3 - web3 instance connected to the chain
+            head - (int) the block the relayer is about to scan up to
+
+            Check that the blocks recorded so far are still on the canonical chain, then record the head's hash
+            Returns None if nothing changed, or the last block still on the canonical chain if a reorg
+            replaced blocks the relayer had already scanned
+            A recorded block the node does not have (it is behind the node the block was recorded from, or the
+            lookup failed) says nothing about a reorg: it is checked again on the next update
+        """
+        with self.lock:
+            numbers = [head]
+            if self.blocks:
+                numbers.insert(0, self.blocks[-1][0])
+            hashes = get_block_hashes(w3, numbers)
+
+            fork_block = None
+            if self.blocks and self.blocks[-1][0] not in hashes:
+                return None
+            if self.blocks and hashes[self.blocks[-1][0]] != self.blocks[-1][1]:
+                fork_block = self.find_fork(w3)
+                hashes = get_block_hashes(w3, [head])
+                self.db.execute("DELETE FROM block_hashes WHERE chain = ? AND number > ?", (self.chain, fork_block))
+            if head in hashes and (not self.blocks or head > self.blocks[-1][0]):
+                self.blocks.append((head, hashes[head]))
+                self.db.execute("INSERT OR REPLACE INTO block_hashes (chain, number, hash) VALUES (?, ?, ?)",
+                                (self.chain, head, hashes[head]))
+                self.db.execute("DELETE FROM block_hashes WHERE chain = ? AND number < ?",
+                                (self.chain, self.blocks[0][0]))
+            self.db.commit()
+            return fork_block
+
+
+_rings = {}
+_rings_lock = threading.Lock()
+
+
+def get_block_hash_ring(chain, path=STATE_FILE):
+    """
+        Returns the process-wide BlockHashRing for this chain and state file
+    """
+    with _rings_lock:
+        if (chain, path) not in _rings:
+            _rings[(chain, path)] = BlockHashRing(chain, path)
+        return _rings[(chain, path)]
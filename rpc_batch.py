@@ -0,0 +1,96 @@
+from web3 import Web3
+
+
+class RPCError(Exception):
+    """
+        Error returned by the node for one request of a batch
+    """
+
+    def __init__(self, error):
+        self.error = error
+        super().__init__(error.get('message', error) if isinstance(error, dict) else error)
+
+
+def batch_request(w3, requests):
+    """
+        w3 - web3 instance
+        requests - (list of tuples) (method, params) of each JSON-RPC request
+
+        Send all the requests in a single JSON-RPC batch (one HTTP round trip)
+        Returns the raw result of each request in order, with an RPCError in place of the result
+        of any request that failed, or None if the provider or endpoint does not support batching
+    """
+    if not requests:
+        return []
+    try:
+        responses = w3.provider.make_batch_request(requests)
+    except (NotImplementedError, AttributeError):
+        return None
+    if not isinstance(responses, list):
+        # A single error response means the endpoint rejected the batch as a whole
+        return None
+
+    # Batch responses may come back in any order, match them to the requests by id
+    responses = sorted(responses, key=lambda response: response.get('id', 0))
+    return [RPCError(response['error']) if 'error' in response else response.get('result')
+            for response in responses]
+
+
+def to_int(quantity):
+    """
+        Convert a JSON-RPC hex quantity to an integer
+    """
+    return int(quantity, 16) if isinstance(quantity, str) else quantity
+
+
+def fetch_tx_metadata(w3, txs, counts=(), fee_history=None):
+    """
+        w3 - web3 instance connected to the chain the transactions will be sent on
+        txs - (list of dicts) the 'from', 'to' and 'data' of each transaction to estimate
+        counts - (list of tuples) (address, block tag) of each transaction count to fetch as well,
+                 e.g. (sender, 'pending') for a sender's next nonce
+        fee_history - (list) params of an eth_feeHistory request to send as well (see fees.fee_history_request)
+
+        Fetch the chain id, the gas price, the fee history, the transaction counts and the gas estimate of every
+        transaction with a single batched HTTP request
+        Returns (chain_id, gas_price, fee_history, counts, estimates) where fee_history is None if it was not
+        asked for or the node does not support it, and estimates holds an int or an exception for each transaction
+    """
+    counts = [(Web3.to_checksum_address(address), block) for address, block in counts]
+    txs = [{'from': Web3.to_checksum_address(tx['from']), 'to': tx['to'], 'data': tx['data']} for tx in txs]
+    requests = [('eth_chainId', []), ('eth_gasPrice', [])]
+    requests.extend(('eth_getTransactionCount', [address, block]) for address, block in counts)
+    if fee_history is not None:
+        requests.append(('eth_feeHistory', fee_history))
+    requests.extend(('eth_estimateGas', [tx]) for tx in txs)
+
+    results = batch_request(w3, requests)
+    if results is None:
+        # No batching available, make the same requests one at a time
+        results = [w3.eth.chain_id, w3.eth.gas_price]
+        results.extend(w3.eth.get_transaction_count(address, block) for address, block in counts)
+        if fee_history is not None:
+            try:
+                results.append(w3.eth.fee_history(to_int(fee_history[0]), *fee_history[1:]))
+            except Exception as e:
+                results.append(e)
+        for tx in txs:
+            try:
+                results.append(w3.eth.estimate_gas(tx))
+            except Exception as e:
+                results.append(e)
+
+    history = None
+    if fee_history is not None:
+        history = results.pop(2 + len(counts))
+        if isinstance(history, Exception):
+            history = None
+    metadata = results[:2 + len(counts)]
+    for result in metadata:
+        if isinstance(result, Exception):
+            raise result
+    chain_id, gas_price = to_int(metadata[0]), to_int(metadata[1])
+    counts = [to_int(result) for result in metadata[2:]]
+    estimates = [result if isinstance(result, Exception) else to_int(result)
+                 for result in results[len(metadata):]]
+    return chain_id, gas_price, history, counts, estimates
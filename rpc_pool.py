@@ -0,0 +1,384 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from eth_utils import keccak
+from web3.providers import JSONBaseProvider
+from web3.providers.rpc import HTTPProvider
+
+from metrics import RPC_ERRORS, RPC_SECONDS, RPC_THROTTLE_SECONDS
+from nonces import is_known_tx_error, is_nonce_error
+from rate_limit import TokenBucket, backoff_delay, SUBMIT, SCAN, BACKGROUND, PRIORITY_NAMES
+
+# Requests that change state go to one endpoint at a time and are never hedged
+WRITE_METHODS = ("eth_sendRawTransaction", "eth_sendTransaction")
+
+# Reads whose latency depends on the query rather than the endpoint (a wide eth_getLogs range is slow everywhere),
+# hedging them would only double the load
+UNHEDGED_METHODS = WRITE_METHODS + ("eth_getLogs",)
+
+# Reads that discover new transfers (log scans, the chain head and the block hashes checked for reorgs),
+# scheduled ahead of other reads when an endpoint's rate limit budget runs short
+SCAN_METHODS = ("eth_getLogs", "eth_blockNumber", "eth_getBlockByNumber")
+
+# Times a request is retried, with a jittered backoff, when every endpoint is rate limiting us
+OVERLOAD_RETRIES = 4
+
+# HTTP statuses of an endpoint that is rate limiting us or overloaded
+OVERLOAD_STATUSES = (429, 503)
+
+# JSON-RPC error codes some providers use for rate limiting (429 echoes the HTTP status)
+OVERLOAD_CODES = (429, -32029)
+
+# Phrases of JSON-RPC error messages that mean the endpoint is overloaded or rate limiting us, rather than that
+# the request itself is invalid, e.g. "rate limit exceeded" or "Too Many Requests"
+# Only the message is matched: the error data can hold anything (revert data, balances, ...)
+OVERLOAD_ERRORS = ("rate limit", "too many requests", "request limit", "request count exceeded",
+                   "capacity exceeded", "over capacity", "server is busy", "server busy", "service unavailable",
+                   "temporarily unavailable")
+
+
+class EndpointOverloaded(Exception):
+    pass
+
+
+def is_overload_error(error):
+    """
+        error - an exception raised by a request, or the 'error' member of a JSON-RPC response
+        True if the endpoint answered with an overload HTTP status, or with a JSON-RPC error whose code or
+        message says it is rate limiting us or overloaded
+    """
+    if isinstance(error, EndpointOverloaded):
+        return True
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) in OVERLOAD_STATUSES:
+        return True
+    if isinstance(error, BaseException):
+        # web3 raises the JSON-RPC errors it gets as Web3RPCError, which keeps the response
+        rpc_response = getattr(error, 'rpc_response', None)
+        error = rpc_response.get('error') if isinstance(rpc_response, dict) else None
+    if not isinstance(error, dict):
+        return False
+    message = str(error.get('message', '')).lower()
+    return error.get('code') in OVERLOAD_CODES or any(marker in message for marker in OVERLOAD_ERRORS)
+
+
+def priority_of(methods):
+    """
+        Returns the priority class of a request (or a batch) calling these methods, the most urgent one wins
+    """
+    return min(SUBMIT if method in WRITE_METHODS else SCAN if method in SCAN_METHODS else BACKGROUND
+               for method in methods)
+
+
+def retry_after(error):
+    """
+        Returns the seconds an HTTP 429 (or 503) response asked us to wait in its Retry-After header, or None
+    """
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class Endpoint:
+    """
+        One RPC endpoint and its health: the average latency of its responses and how often it failed recently,
+        and its request budget when the endpoint is rate limited
+    """
+
+    def __init__(self, url, session=None, timeout=10, rate_limit=None):
+        """
+            url - (string) HTTP(S) JSON-RPC endpoint
+            session - (requests.Session) session to send the requests with, several endpoints can share one
+            timeout - (float) seconds before a request is abandoned and the next endpoint tried
+            rate_limit - (tuple) (requests per second, burst) the endpoint allows, None if it is not limited
+        """
+        self.url = url
+        # The pool does its own failover, so web3 should not retry a failing endpoint
+        self.provider = HTTPProvider(url, session=session, request_kwargs={'timeout': timeout},
+                                     exception_retry_configuration=None)
+        self.budget = TokenBucket(*rate_limit) if rate_limit is not None else None
+        self.latency = None  # exponentially weighted average, in seconds
+        self.failures = 0  # consecutive failures
+        self.retry_at = 0.0  # the endpoint is skipped until then after a failure
+
+    def score(self):
+        """
+            Lower is better: endpoints whose last request failed rank after those whose last request succeeded,
+            then by average latency. Endpoints that have not answered yet rank first so they are measured early
+        """
+        return self.failures, 0.0 if self.latency is None else self.latency
+
+    def succeeded(self, elapsed, alpha=0.3):
+        self.latency = elapsed if self.latency is None else alpha * elapsed + (1 - alpha) * self.latency
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def failed(self, base_cooldown=1.0, max_cooldown=60.0, cooldown=None):
+        # Back off exponentially from an endpoint that keeps failing, unless it told us how long to wait
+        self.failures += 1
+        if cooldown is None:
+            cooldown = min(max_cooldown, base_cooldown * 2 ** (self.failures - 1))
+        self.retry_at = time.monotonic() + cooldown
+
+    def saturated(self):
+        """
+            True if a request sent to this endpoint now would have to wait for its rate limit budget
+        """
+        return self.budget is not None and not self.budget.available()
+
+    def __repr__(self):
+        latency = "?" if self.latency is None else f"{self.latency * 1000:.0f}ms"
+        return f"Endpoint({self.url}, latency={latency}, failures={self.failures})"
+
+
+class RPCPool(JSONBaseProvider):
+    """
+        web3 provider spreading requests over several endpoints of the same chain
+        Each request goes to the healthiest endpoint (lowest measured latency, fewest recent failures).
+        Endpoints that fail, time out or rate limit us are put on a cooldown and the request is retried on the
+        next one. Reads that take much longer than the endpoint's usual latency are hedged: the same request
+        is sent to the next endpoint too and whichever answers first is used
+        Endpoints with a rate limit get a token bucket budget. Requests wait for the budget by priority class
+        (transaction submissions, then log scans, then other reads), and go to endpoints with budget to spare
+        first. When every endpoint rate limits a request, it is retried after a jittered backoff
+        Reads that must agree with each other (a scan's head, logs and block hashes, the nonces its relays are
+        built from) go through a pinned view of the pool instead, see pinned()
+    """
+
+    def __init__(self, urls, session=None, timeout=10, hedge_factor=3.0, min_hedge_delay=0.25, workers=8,
+                 chain='', rate_limits=None):
+        """
+            urls - (list of strings) JSON-RPC endpoints, all serving the same chain
+            session - (requests.Session) session shared by the endpoints
+            timeout - (float) seconds before a request to one endpoint is abandoned
+            hedge_factor - (float) a read is hedged once it has taken this many times the endpoint's average latency
+            min_hedge_delay - (float) never hedge a read before this many seconds
+            workers - (int) maximum number of requests (including hedges) in flight at once
+            chain - (string) name of the chain, used to label the request metrics
+            rate_limits - (dictionary) url -> (requests per second, burst) of the endpoints that are rate limited
+        """
+        super().__init__()
+        self.chain = chain
+        rate_limits = rate_limits or {}
+        self.endpoints = [Endpoint(url, session, timeout, rate_limits.get(url)) for url in urls]
+        self.hedge_factor = hedge_factor
+        self.min_hedge_delay = min_hedge_delay
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pin = None  # endpoint of the last pinned view
+
+    def ranked(self):
+        """
+            Returns the endpoints from best to worst, those out of rate limit budget after those with budget
+            to spare, and those cooling down after a failure last
+        """
+        now = time.monotonic()
+        with self.lock:
+            available = sorted((endpoint for endpoint in self.endpoints if endpoint.retry_at <= now),
+                               key=lambda endpoint: (endpoint.saturated(), endpoint.score()))
+            cooling_down = sorted((endpoint for endpoint in self.endpoints if endpoint.retry_at > now),
+                                  key=lambda endpoint: endpoint.retry_at)
+        return available + cooling_down
+
+    def hedge_delay(self, endpoint):
+        latency = self.min_hedge_delay if endpoint.latency is None else endpoint.latency
+        return max(self.min_hedge_delay, self.hedge_factor * latency)
+
+    def call(self, endpoint, method, send, priority=BACKGROUND, cost=1):
+        """
+            Wait for the endpoint's rate limit budget, run send(endpoint.provider) and update the endpoint's
+            health with the outcome
+            Raises if the endpoint failed or answered with an overload error
+        """
+        if endpoint.budget is not None:
+            RPC_THROTTLE_SECONDS.observe(endpoint.budget.acquire(priority, cost), self.chain, PRIORITY_NAMES[priority])
+        start = time.monotonic()
+        try:
+            response = send(endpoint.provider)
+            if isinstance(response, dict) and 'error' in response and is_overload_error(response['error']):
+                raise EndpointOverloaded(f"{endpoint.url}: {response['error']}")
+        except Exception as e:
+            overloaded = isinstance(e, EndpointOverloaded) or is_overload_error(e)
+            with self.lock:
+                endpoint.failed(cooldown=retry_after(e) if overloaded else None)
+            if overloaded and endpoint.budget is not None:
+                endpoint.budget.throttle()
+            RPC_ERRORS.inc(self.chain, method, endpoint.url)
+            raise
+        elapsed = time.monotonic() - start
+        with self.lock:
+            endpoint.succeeded(elapsed)
+        if endpoint.budget is not None:
+            endpoint.budget.recover()
+        RPC_SECONDS.observe(elapsed, self.chain, method)
+        return response
+
+    def retrying(self, attempt):
+        """
+            Run attempt() again after a jittered backoff while it fails because every endpoint is rate limiting us
+        """
+        for retry in range(OVERLOAD_RETRIES + 1):
+            try:
+                return attempt()
+            except Exception as e:
+                if retry == OVERLOAD_RETRIES or not is_overload_error(e):
+                    raise
+                time.sleep(backoff_delay(retry))
+
+    def failover(self, method, send, priority=BACKGROUND, cost=1, first=None):
+        """
+            Try the endpoints one at a time, best first (or 'first' first when given), until one answers
+        """
+        endpoints = self.ranked()
+        if first is not None:
+            endpoints = [first] + [endpoint for endpoint in endpoints if endpoint is not first]
+        error = None
+        for endpoint in endpoints:
+            try:
+                return self.call(endpoint, method, send, priority, cost)
+            except Exception as e:
+                error = e
+        raise error
+
+    def hedged(self, method, send, priority=BACKGROUND):
+        """
+            Send to the best endpoint, and to the next one as well whenever the requests in flight fail
+            or are slower than the hedge delay. Returns the first successful response
+        """
+        remaining = deque(self.ranked())
+        in_flight = {}
+        error = None
+
+        def launch():
+            endpoint = remaining.popleft()
+            in_flight[self.executor.submit(self.call, endpoint, method, send, priority)] = endpoint
+            return endpoint
+
+        latest = launch()
+        while in_flight:
+            delay = self.hedge_delay(latest) if remaining else None
+            done, _ = wait(in_flight, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                # The endpoint is at least this slow, rank it accordingly before its answer comes in
+                with self.lock:
+                    latest.latency = max(latest.latency or 0.0, delay)
+            for future in done:
+                in_flight.pop(future)
+                try:
+                    # Slower requests still in flight finish in the background and update their endpoint's latency
+                    return future.result()
+                except Exception as e:
+                    error = e
+            # Either the hedge delay passed or every finished request failed: bring in the next endpoint
+            if remaining:
+                latest = launch()
+        raise error
+
+    def make_request(self, method, params):
+        send = lambda provider: provider.make_request(method, params)
+        priority = priority_of([method])
+        if method == "eth_sendRawTransaction":
+            return self.retrying(lambda: self.send_raw_transaction(send, params[0]))
+        if method in UNHEDGED_METHODS or len(self.endpoints) == 1:
+            return self.retrying(lambda: self.failover(method, send, priority))
+        return self.retrying(lambda: self.hedged(method, send, priority))
+
+    def send_raw_transaction(self, send, raw_transaction, first=None):
+        """
+            An endpoint that timed out may still have broadcast the transaction, in which case the endpoint
+            it fails over to rejects it as already known, or as "nonce too low" once it was mined. That means
+            the transaction was sent, so return its hash rather than an error that would make the caller sign
+            it again with a new nonce. A nonce error is only taken as ours once the node has the transaction
+            first - (Endpoint) endpoint to send to before the others, see PinnedProvider
+        """
+        response = self.failover("eth_sendRawTransaction", send, SUBMIT, first=first)
+        error = response.get('error') if isinstance(response, dict) else None
+        if error is None:
+            return response
+        raw = bytes.fromhex(raw_transaction[2:]) if isinstance(raw_transaction, str) else bytes(raw_transaction)
+        tx_hash = '0x' + keccak(raw).hex()
+        if is_known_tx_error(error) or (is_nonce_error(error) and self.has_transaction(tx_hash)):
+            return {'jsonrpc': '2.0', 'id': response.get('id'), 'result': tx_hash}
+        return response
+
+    def has_transaction(self, tx_hash):
+        """
+            True if an endpoint knows the transaction, mined or still in its mempool
+        """
+        send = lambda provider: provider.make_request("eth_getTransactionByHash", [tx_hash])
+        try:
+            response = self.failover("eth_getTransactionByHash", send, SUBMIT)
+        except Exception:
+            return False
+        return isinstance(response, dict) and response.get('result') is not None
+
+    def make_batch_request(self, requests):
+        # Rate limits count every call in a batch
+        send = lambda provider: provider.make_batch_request(requests)
+        priority = priority_of([method for method, _ in requests])
+        return self.retrying(lambda: self.failover("batch", send, priority, len(requests)))
+
+    def is_connected(self, show_traceback=False):
+        return any(endpoint.provider.is_connected(show_traceback) for endpoint in self.ranked())
+
+    def pinned(self):
+        """
+            Returns a provider sending every read to a single endpoint of the pool (see PinnedProvider)
+            The endpoint pinned last time is pinned again as long as it has not failed since, so the nonces and
+            the mempool the relayer reads stay those of the node its transactions were sent to. Otherwise the
+            best ranked endpoint is pinned
+        """
+        with self.lock:
+            endpoint = self.pin
+        if endpoint is None or endpoint.failures or endpoint.retry_at > time.monotonic():
+            endpoint = self.ranked()[0]
+        with self.lock:
+            self.pin = endpoint
+        return PinnedProvider(self, endpoint)
+
+
+class PinnedProvider(JSONBaseProvider):
+    """
+        web3 provider sending every read to one endpoint of an RPCPool, so that a series of reads sees a single
+        node's view of the chain. Endpoints can be a few blocks apart: a scan that took its head from one node
+        and its logs from another that is behind would skip the blocks in between for good
+        Reads are neither hedged nor failed over: when the endpoint fails the read raises, and the caller starts
+        over with a new pinned view. Transactions go to the pinned endpoint first and fail over like any other
+        send, since sending through a node that is behind loses nothing
+        Requests still count against the endpoint's rate limit budget and update its health
+    """
+
+    def __init__(self, pool, endpoint):
+        """
+            pool - (RPCPool) the pool the endpoint belongs to
+            endpoint - (Endpoint) the endpoint every read goes to
+        """
+        super().__init__()
+        self.pool = pool
+        self.endpoint = endpoint
+
+    def make_request(self, method, params):
+        send = lambda provider: provider.make_request(method, params)
+        if method == "eth_sendRawTransaction":
+            return self.pool.retrying(lambda: self.pool.send_raw_transaction(send, params[0], first=self.endpoint))
+        priority = priority_of([method])
+        return self.pool.retrying(lambda: self.pool.call(self.endpoint, method, send, priority))
+
+    def make_batch_request(self, requests):
+        send = lambda provider: provider.make_batch_request(requests)
+        priority = priority_of([method for method, _ in requests])
+        return self.pool.retrying(lambda: self.pool.call(self.endpoint, "batch", send, priority, len(requests)))
+
+    def is_connected(self, show_traceback=False):
+        return self.endpoint.provider.is_connected(show_traceback)
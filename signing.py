@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Transactions signed per task on the worker processes, batches up to this size are signed inline
+# since starting and feeding the workers would take longer than signing them
+# Signing on the workers means handing them the warden keys: each task pickles its transactions' keys through a
+# pipe to a child process of the relayer, running as the same user. Nothing is written to disk and the workers
+# drop the keys once the task is signed, but for the duration of the task the keys are in another process's memory
+# too. Relays are batched (see bridge.MAX_BATCH_SIZE), so the workers only come into play for large backlogs;
+# pass chunk=len(items) (or more) to sign_ahead to keep every key in the relayer's own process
+SIGNING_CHUNK = 32
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def sign_transactions(items):
+    """
+        items - (list of tuples) (private key, transaction dict) of each transaction
+
+        Returns the (raw transaction, hash) of each transaction, signed in order
+        Runs on the signing worker processes (which receive the private keys, see SIGNING_CHUNK),
+        or inline for small batches
+    """
+    from eth_account import Account
+
+    signed = [Account.sign_transaction(tx, private_key) for private_key, tx in items]
+    return [(bytes(signed_tx.raw_transaction), bytes(signed_tx.hash)) for signed_tx in signed]
+
+
+def get_signing_pool(workers=None):
+    """
+        Returns the process-wide pool of signing workers, started on first use
+        Workers are forked from a clean server process (with eth_account already imported) rather than from
+        the relayer, so they do not inherit its threads and open connections
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['eth_account'])
+            _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context)
+        return _pool
+
+
+def sign_ahead(items, chunk=SIGNING_CHUNK):
+    """
+        items - (list of tuples) (private key, transaction dict) of each transaction
+        chunk - (int) transactions signed per worker task
+
+        Yields the (raw transaction, hash) of each transaction in order
+        Large batches are split into chunks that are all handed to the signing workers up front, so the caller
+        can send the first transactions while the later ones are still being signed
+        Batches of at most 'chunk' transactions are signed in this process and their keys never leave it
+    """
+    if len(items) <= chunk:
+        yield from sign_transactions(items)
+        return
+    pool = get_signing_pool()
+    futures = [pool.submit(sign_transactions, items[start:start + chunk]) for start in range(0, len(items), chunk)]
+    for future in futures:
+        yield from future.result()
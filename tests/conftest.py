@@ -0,0 +1,102 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# The relayer modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class NodeError(Exception):
+    """
+        Raised by a stand-in node's handler to answer with a JSON-RPC error, or with a bare HTTP error status
+        when 'status' is given
+    """
+
+    def __init__(self, message, code=-32000, data=None, status=None):
+        super().__init__(message)
+        self.code = code
+        self.data = data
+        self.status = status
+
+
+class StandInNode:
+    """
+        Local JSON-RPC endpoint standing in for a public node
+        handler(method, params) returns the result of each request, or raises NodeError to answer with an error,
+        and delays[method] holds the seconds the node takes to answer that method
+        Batches are answered request by request
+    """
+
+    def __init__(self, handler, delays=None):
+        self.handler = handler
+        self.delays = delays or {}
+        self.calls = []  # methods received, in order
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def answer(self, request):
+                node.calls.append(request['method'])
+                time.sleep(node.delays.get(request['method'], 0))
+                try:
+                    return {'jsonrpc': '2.0', 'id': request['id'],
+                            'result': node.handler(request['method'], request['params'])}
+                except NodeError as e:
+                    if e.status is not None:
+                        raise
+                    error = {'code': e.code, 'message': str(e)}
+                    if e.data is not None:
+                        error['data'] = e.data
+                    return {'jsonrpc': '2.0', 'id': request['id'], 'error': error}
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                status = 200
+                try:
+                    if isinstance(request, list):
+                        response = [self.answer(item) for item in request]
+                    else:
+                        response = self.answer(request)
+                except NodeError as e:
+                    status, response = e.status, str(e)
+                body = json.dumps(response).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out and hung up
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in_node():
+    """
+        Factory of StandInNodes, shut down at the end of the test
+    """
+    nodes = []
+
+    def make(handler, delays=None):
+        nodes.append(StandInNode(handler, delays))
+        return nodes[-1]
+
+    yield make
+    for node in nodes:
+        node.close()
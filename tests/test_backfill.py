@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+from eth_abi import encode
+
+from backfill import ChunkedLogScanner
+from events import TOPICS
+
+CONTRACT = SimpleNamespace(address='0x' + '44' * 20)
+
+
+class LogNode:
+    """
+        Stand-in for w3.eth answering eth_getLogs with one Deposit per block, and failing queries that span more
+        than max_blocks blocks with 'error'
+    """
+
+    def __init__(self, max_blocks, error):
+        self.max_blocks = max_blocks
+        self.error = error
+        self.queries = []
+        self.eth = self
+
+    def get_logs(self, query):
+        start_block, end_block = query['fromBlock'], query['toBlock']
+        self.queries.append((start_block, end_block))
+        if end_block - start_block + 1 > self.max_blocks:
+            raise self.error
+        topic = '0x' + encode(['address'], ['0x' + '11' * 20]).hex()
+        return [{'address': CONTRACT.address, 'topics': [TOPICS['Deposit'], topic, topic],
+                 'data': '0x' + encode(['uint256'], [block]).hex(), 'blockNumber': hex(block), 'logIndex': '0x0',
+                 'transactionHash': '0x' + f'{block:064x}'} for block in range(start_block, end_block + 1)]
+
+
+def test_range_errors_split_the_chunk():
+    node = LogNode(max_blocks=3, error=ValueError("query returned more than 10000 results"))
+    events = ChunkedLogScanner(node, CONTRACT, 'Deposit', chunk_size=8, workers=2).scan(1, 20)
+
+    assert [event.block_number for event in events] == list(range(1, 21))
+    assert [event.amount for event in events] == list(range(1, 21))
+    # Every block was fetched exactly once by a query that succeeded
+    succeeded = [(start, end) for start, end in node.queries if end - start + 1 <= 3]
+    assert sorted(block for start, end in succeeded for block in range(start, end + 1)) == list(range(1, 21))
+
+
+@pytest.mark.parametrize('error', [ValueError("rate limit exceeded"), ConnectionError("connection reset by peer")])
+def test_other_errors_are_not_split(error):
+    node = LogNode(max_blocks=3, error=error)
+    with pytest.raises(type(error)):
+        ChunkedLogScanner(node, CONTRACT, 'Deposit', chunk_size=8, workers=1).scan(1, 20)
+    assert node.queries == [(1, 8)]
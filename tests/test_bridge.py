@@ -0,0 +1,156 @@
+import math
+
+import pytest
+from eth_account import Account
+from web3 import Web3
+
+from bridge import DROPPED_AFTER_BLOCKS, REPLACE_AFTER_BLOCKS, resolve_in_flight
+from events import relay_args
+from fees import REPLACEMENT_BUMP
+from ledger import RelayLedger, CONFIRMED, SUBMITTED
+from rpc_pool import RPCPool
+from test_ledger import deposit, state
+
+KEY = '0x' + '11' * 32
+SENDER = Account.from_key(KEY).address
+TX_HASH = '0x' + 'ab' * 32
+NONCE = 5
+GAS_PRICE = 10 ** 9
+# The relay as it was signed, relays of source chain events are sent on the destination chain
+TX = {'to': '0x' + '44' * 20, 'data': '0x', 'value': 0, 'gas': 100000, 'gasPrice': GAS_PRICE, 'nonce': NONCE,
+      'chainId': 1}
+
+
+class Chain:
+    """
+        State of the relay chain as seen by a stand-in node
+    """
+
+    def __init__(self):
+        self.head = 100
+        self.count = NONCE  # the sender's mined transaction count
+        self.receipt = None
+        self.known = False
+        self.sent = []  # raw transactions sent to the node
+
+    def handler(self, method, params):
+        if method == 'eth_blockNumber':
+            return hex(self.head)
+        if method == 'eth_getTransactionCount':
+            return hex(self.count)
+        if method == 'eth_getTransactionReceipt':
+            return self.receipt
+        if method == 'eth_getTransactionByHash':
+            return {'hash': TX_HASH, 'blockNumber': None} if self.known else None
+        if method == 'eth_gasPrice':
+            return hex(GAS_PRICE)
+        if method == 'eth_feeHistory':
+            return None
+        if method == 'eth_sendRawTransaction':
+            self.sent.append(params[0])
+            return Web3.keccak(hexstr=params[0]).to_0x_hex()
+        raise AssertionError(method)
+
+
+@pytest.fixture
+def relay(tmp_path, stand_in_node):
+    """
+        A ledger with one relay in flight, and the chain and web3 instance it was sent on
+    """
+    ledger = RelayLedger(str(tmp_path / "state.db"))
+    ledger.discover('source', [deposit('0xaa', 0, 10)], relay_args)
+    keys, _ = ledger.pending('source')
+    ledger.submit(keys, TX_HASH, SENDER, NONCE, TX)
+    chain = Chain()
+    node = stand_in_node(chain.handler)
+    yield ledger, keys[0], chain, node, Web3(RPCPool([node.url]))
+    ledger.close()
+
+
+def test_mined_relay_is_confirmed(relay):
+    ledger, key, chain, node, w3 = relay
+    chain.count = NONCE + 1
+    chain.receipt = {'transactionHash': TX_HASH, 'status': '0x1', 'blockNumber': hex(chain.head), 'gasUsed': '0x5208'}
+
+    assert resolve_in_flight(w3, 'source', ledger) == 0
+    assert state(ledger, key)[:2] == (CONFIRMED, TX_HASH)
+    # Head, nonce, receipt and transaction lookup all went out in one batch
+    assert node.calls == ['eth_blockNumber', 'eth_getTransactionCount', 'eth_getTransactionReceipt',
+                          'eth_getTransactionByHash']
+
+
+def test_relay_waiting_for_its_nonce_stays_in_flight(relay):
+    ledger, key, chain, node, w3 = relay
+    chain.known = True
+    for _ in range(DROPPED_AFTER_BLOCKS + 1):
+        assert resolve_in_flight(w3, 'source', ledger) == 1
+        chain.head += 1
+    assert state(ledger, key)[0] == SUBMITTED
+
+
+def test_dropped_relay_is_requeued_after_a_few_blocks(relay):
+    ledger, key, chain, node, w3 = relay
+    # The nonce was used by another transaction and no node knows the relay
+    chain.count = NONCE + 1
+    for _ in range(DROPPED_AFTER_BLOCKS):
+        assert resolve_in_flight(w3, 'source', ledger) == 1
+        chain.head += 1
+    assert resolve_in_flight(w3, 'source', ledger) == 0
+    assert ledger.pending('source')[0] == [key]
+
+
+def test_relay_known_to_the_node_is_not_requeued(relay):
+    ledger, key, chain, node, w3 = relay
+    # The node has the transaction but not its receipt yet: it is not dropped, however long that lasts
+    chain.count = NONCE + 1
+    chain.known = True
+    for _ in range(2 * DROPPED_AFTER_BLOCKS):
+        assert resolve_in_flight(w3, 'source', ledger) == 1
+        chain.head += 1
+    assert state(ledger, key)[0] == SUBMITTED
+
+
+def test_dropped_streak_starts_over_when_the_relay_reappears(relay):
+    ledger, key, chain, node, w3 = relay
+    chain.count = NONCE + 1
+    resolve_in_flight(w3, 'source', ledger)
+    chain.head += DROPPED_AFTER_BLOCKS - 1
+    chain.known = True
+    resolve_in_flight(w3, 'source', ledger)
+    chain.head += 1
+    chain.known = False
+    assert resolve_in_flight(w3, 'source', ledger) == 1
+    assert state(ledger, key)[0] == SUBMITTED
+
+
+def test_resumed_relay_is_replaced_after_a_few_blocks(relay):
+    ledger, key, chain, node, w3 = relay
+    # No tracker is waiting for the relay (e.g. after a restart) and its nonce is still free
+    chain.known = True
+    for _ in range(REPLACE_AFTER_BLOCKS['destination']):
+        assert resolve_in_flight(w3, 'source', ledger, [KEY]) == 1
+        chain.head += 1
+    assert chain.sent == []
+
+    resolve_in_flight(w3, 'source', ledger, [KEY])
+    replacement = Account.sign_transaction({**TX, 'gasPrice': math.ceil(GAS_PRICE * REPLACEMENT_BUMP)}, KEY)
+    assert chain.sent == [replacement.raw_transaction.to_0x_hex()]
+    new_hash = replacement.hash.to_0x_hex()
+    assert ledger.unconfirmed('source') == [(new_hash, SENDER, NONCE)]
+    assert sorted(ledger.in_flight('source')) == sorted([TX_HASH, new_hash])
+    assert ledger.transaction(new_hash)['gasPrice'] == math.ceil(GAS_PRICE * REPLACEMENT_BUMP)
+
+    # The replacement gets the same number of blocks before it is replaced in turn
+    chain.head += REPLACE_AFTER_BLOCKS['destination'] - 1
+    resolve_in_flight(w3, 'source', ledger, [KEY])
+    assert len(chain.sent) == 1
+
+
+def test_relays_a_tracker_is_waiting_for_are_not_replaced(relay):
+    ledger, key, chain, node, w3 = relay
+    chain.known = True
+    for _ in range(2 * REPLACE_AFTER_BLOCKS['destination']):
+        resolve_in_flight(w3, 'source', ledger, [KEY], tracked={TX_HASH})
+        chain.head += 1
+    assert chain.sent == []
+    assert ledger.unconfirmed('source') == [(TX_HASH, SENDER, NONCE)]
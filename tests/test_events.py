@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+from eth_abi import encode
+from hexbytes import HexBytes
+from web3 import Web3
+
+from events import EVENTS, decode_log
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADDRESS = Web3.to_checksum_address('0x' + '44' * 20)
+VALUES = {
+    'address': lambda i: Web3.to_checksum_address('0x' + f'{i + 1:02x}' * 20),
+    'uint256': lambda i: 10 ** 30 + i,
+}
+
+
+def contract_events():
+    """
+        (contract, event ABI) of every bridge event of the Source and Destination contracts
+    """
+    names = {event_class.name for event_class in EVENTS}
+    w3 = Web3()
+    for artifact in ('Source.json', 'Destination.json'):
+        with open(os.path.join(ROOT, artifact)) as f:
+            abi = json.load(f)['abi']
+        contract = w3.eth.contract(address=ADDRESS, abi=abi)
+        for entry in abi:
+            if entry['type'] == 'event' and entry['name'] in names:
+                yield contract, entry
+
+
+def make_log(entry):
+    """
+        A raw JSON-RPC log of this event with distinct values for every argument, and those values
+    """
+    values = {argument['name']: VALUES[argument['type']](i) for i, argument in enumerate(entry['inputs'])}
+    signature = f"{entry['name']}({','.join(argument['type'] for argument in entry['inputs'])})"
+    topics = [Web3.keccak(text=signature)]
+    topics += [HexBytes(encode([argument['type']], [values[argument['name']]]))
+               for argument in entry['inputs'] if argument['indexed']]
+    unindexed = [argument for argument in entry['inputs'] if not argument['indexed']]
+    data = encode([argument['type'] for argument in unindexed], [values[argument['name']] for argument in unindexed])
+    log = {'address': ADDRESS.lower(), 'topics': [topic.to_0x_hex() for topic in topics], 'data': '0x' + data.hex(),
+           'blockNumber': '0x10', 'logIndex': '0x2', 'transactionIndex': '0x0',
+           'transactionHash': '0x' + 'ab' * 32, 'blockHash': '0x' + 'cd' * 32, 'removed': False}
+    return log, values
+
+
+@pytest.mark.parametrize('contract, entry', [pytest.param(contract, entry, id=entry['name'])
+                                             for contract, entry in contract_events()])
+def test_decode_log_matches_web3(contract, entry):
+    log, values = make_log(entry)
+    formatted = {**log, 'topics': [HexBytes(topic) for topic in log['topics']], 'data': HexBytes(log['data']),
+                 'address': ADDRESS, 'blockNumber': 16, 'logIndex': 2, 'transactionIndex': 0,
+                 'transactionHash': HexBytes(log['transactionHash']), 'blockHash': HexBytes(log['blockHash'])}
+    expected = getattr(contract.events, entry['name'])().process_log(formatted)
+    assert dict(expected['args']) == values
+
+    # Raw JSON-RPC logs and web3 formatted ones decode the same
+    for source in (log, formatted):
+        event = decode_log(source)
+        assert event.name == entry['name']
+        assert {name: getattr(event, name) for name in values} == dict(expected['args'])
+        assert event.address == expected['address']
+        assert event.block_number == expected['blockNumber']
+        assert event.log_index == expected['logIndex']
+        assert event.transaction_hash == expected['transactionHash'].to_0x_hex()
+
+
+def test_decode_log_ignores_other_events():
+    log, _ = make_log(next(contract_events())[1])
+    log['topics'][0] = '0x' + '00' * 32
+    assert decode_log(log) is None
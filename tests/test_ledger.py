@@ -0,0 +1,111 @@
+import pytest
+
+from events import Deposit, relay_args
+from ledger import RelayLedger, CONFIRMED, DISCOVERED, FAILED, SUBMITTED
+
+TOKEN = '0x' + '11' * 20
+RECIPIENT = '0x' + '22' * 20
+SENDER = '0x' + '33' * 20
+
+
+def deposit(tx_hash, log_index, block_number, amount=1):
+    event = Deposit.__new__(Deposit)
+    event.address, event.token, event.recipient, event.amount = TOKEN, TOKEN, RECIPIENT, amount
+    event.transaction_hash, event.log_index, event.block_number = tx_hash, log_index, block_number
+    return event
+
+
+def state(ledger, key):
+    chain, tx_hash, log_index = key
+    return ledger.db.execute("SELECT state, relay_tx_hash, block_number, attempts FROM relays "
+                             "WHERE chain = ? AND tx_hash = ? AND log_index = ?",
+                             (chain, tx_hash, log_index)).fetchone()
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = RelayLedger(str(tmp_path / "state.db"))
+    yield ledger
+    ledger.close()
+
+
+def test_discovering_the_same_events_twice_keeps_their_state(ledger):
+    events = [deposit('0xaa', 0, 10), deposit('0xbb', 1, 10)]
+    ledger.discover('source', events, relay_args)
+    keys, calls = ledger.pending('source')
+    assert keys == [('source', '0xaa', 0), ('source', '0xbb', 1)]
+    assert calls == [(TOKEN, RECIPIENT, 1), (TOKEN, RECIPIENT, 1)]
+
+    ledger.submit(keys[:1], '0x01', SENDER, 0)
+    ledger.discover('source', events, relay_args)
+    assert ledger.pending('source')[0] == keys[1:]
+    assert ledger.in_flight('source') == ['0x01']
+
+
+def test_reincluded_transaction_is_matched_by_position(ledger):
+    ledger.discover('source', [deposit('0xaa', 3, 10), deposit('0xaa', 4, 10, amount=2), deposit('0xbb', 0, 11)],
+                    relay_args)
+    keys, _ = ledger.pending('source')
+    ledger.submit(keys[:2], '0x01', SENDER, 0)
+
+    # Blocks 10 and 11 are reorged out: the relayed events are kept, the one not relayed yet is forgotten
+    assert ledger.invalidate('source', 9) == 2
+    assert ledger.pending('source')[0] == []
+
+    # The first transaction is included again in block 12 at other log indices, the second one is not
+    ledger.discover('source', [deposit('0xaa', 7, 12), deposit('0xaa', 8, 12, amount=2)], relay_args)
+    assert ledger.pending('source')[0] == []
+    assert state(ledger, keys[0]) == (SUBMITTED, '0x01', 12, 0)
+    assert state(ledger, keys[1]) == (SUBMITTED, '0x01', 12, 0)
+
+
+def test_invalidate_only_forgets_events_after_the_fork(ledger):
+    ledger.discover('source', [deposit('0xaa', 0, 10), deposit('0xbb', 0, 11)], relay_args)
+    assert ledger.invalidate('source', 10) == 0
+    assert ledger.pending('source')[0] == [('source', '0xaa', 0)]
+
+
+def test_replaced_relays_resolve_by_any_of_their_hashes(ledger):
+    ledger.discover('source', [deposit('0xaa', 0, 10)], relay_args)
+    keys, _ = ledger.pending('source')
+    ledger.submit(keys, '0x01', SENDER, 5, {'nonce': 5, 'gasPrice': 10})
+    ledger.replace('0x01', '0x02', {'nonce': 5, 'gasPrice': 12})
+    ledger.replace('0x02', '0x03')
+    assert sorted(ledger.in_flight('source')) == ['0x01', '0x02', '0x03']
+    assert sorted(ledger.relay_hashes('0x03')) == ['0x01', '0x02', '0x03']
+    assert ledger.unconfirmed('source') == [('0x03', SENDER, 5)]
+    # A replacement sent without its fields keeps those of the transaction it replaced
+    assert ledger.transaction('0x03') == {'nonce': 5, 'gasPrice': 12}
+
+    # The original was mined after all: the relay is confirmed under the hash that was mined
+    ledger.resolve('0x01', True)
+    assert state(ledger, keys[0]) == (CONFIRMED, '0x01', 10, 0)
+    assert ledger.in_flight('source') == []
+
+
+def test_requeue_by_a_replaced_hash(ledger):
+    ledger.discover('source', [deposit('0xaa', 0, 10)], relay_args)
+    keys, _ = ledger.pending('source')
+    ledger.submit(keys, '0x01', SENDER, 5)
+    ledger.replace('0x01', '0x02')
+
+    assert ledger.requeue('0x01') == 1
+    assert state(ledger, keys[0]) == (DISCOVERED, None, 10, 0)
+    assert ledger.in_flight('source') == []
+    # A late receipt of a requeued relay does not touch it
+    ledger.resolve('0x02', True)
+    assert state(ledger, keys[0])[0] == DISCOVERED
+
+
+def test_failed_relays_are_retried_up_to_max_attempts(ledger):
+    ledger.discover('source', [deposit('0xaa', 0, 10)], relay_args)
+    keys, _ = ledger.pending('source')
+    ledger.submit(keys, '0x01', SENDER, 5)
+    ledger.resolve('0x01', False)
+    assert state(ledger, keys[0]) == (FAILED, '0x01', 10, 1)
+    assert ledger.retry_failed('source', max_attempts=2, delay=-1) == 1
+
+    # The second attempt fails its gas estimate
+    ledger.fail(keys)
+    assert state(ledger, keys[0]) == (FAILED, None, 10, 2)
+    assert ledger.retry_failed('source', max_attempts=2, delay=-1) == 0
@@ -0,0 +1,55 @@
+import pytest
+from web3 import Web3
+
+from reorg import BlockHashRing
+
+
+class Chain:
+    """
+        Block hashes served by a stand-in node, up to its head
+    """
+
+    def __init__(self, head):
+        self.head = head
+        self.hashes = {}
+
+    def block_hash(self, number):
+        return self.hashes.get(number, '0x' + f'{number:064x}')
+
+    def handler(self, method, params):
+        number = int(params[0], 16)
+        if number > self.head:
+            return None
+        return {'number': hex(number), 'hash': self.block_hash(number)}
+
+
+@pytest.fixture
+def chain(stand_in_node):
+    chain = Chain(head=100)
+    chain.w3 = Web3(Web3.HTTPProvider(stand_in_node(chain.handler).url))
+    return chain
+
+
+def test_unchanged_chain(chain, tmp_path):
+    ring = BlockHashRing('source', str(tmp_path / "state.db"))
+    assert ring.update(chain.w3, 90) is None
+    assert ring.update(chain.w3, 100) is None
+
+
+def test_reorg_is_detected(chain, tmp_path):
+    ring = BlockHashRing('source', str(tmp_path / "state.db"))
+    for head in (90, 95, 100):
+        ring.update(chain.w3, head)
+    chain.hashes = {number: '0x' + 'ff' * 32 for number in range(93, 101)}
+    assert ring.update(chain.w3, 100) == 90
+
+
+def test_block_the_node_does_not_have_is_not_a_reorg(chain, tmp_path):
+    ring = BlockHashRing('source', str(tmp_path / "state.db"))
+    ring.update(chain.w3, 100)
+    # The next scan reads from a node two blocks behind
+    chain.head = 98
+    assert ring.update(chain.w3, 98) is None
+    chain.head = 101
+    assert ring.update(chain.w3, 101) is None
+    assert [number for number, _ in ring.blocks] == [100, 101]
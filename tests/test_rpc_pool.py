@@ -0,0 +1,179 @@
+import time
+
+import pytest
+from eth_utils import keccak
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.exceptions import Web3RPCError
+
+from conftest import NodeError
+from rpc_pool import RPCPool
+
+RAW_TX = bytes.fromhex('02f86b01') + bytes(range(64))
+TX_HASH = '0x' + keccak(RAW_TX).hex()
+
+
+def answer(results):
+    """
+        Handler answering each method with a fixed result, or with an error for NodeError results
+    """
+    def handler(method, params):
+        result = results[method]
+        if isinstance(result, NodeError):
+            raise result
+        return result
+    return handler
+
+
+def test_failover_skips_an_endpoint_that_is_down(stand_in_node):
+    down = stand_in_node(answer({}))
+    down.close()
+    up = stand_in_node(answer({'eth_getLogs': []}))
+    pool = RPCPool([down.url, up.url], timeout=1)
+
+    assert Web3(pool).eth.get_logs({'fromBlock': 1, 'toBlock': 2}) == []
+    assert pool.endpoints[0].failures == 1
+    # The failed endpoint cools down, the next requests go straight to the healthy one
+    assert pool.ranked()[0].url == up.url
+
+
+def test_failover_after_a_timeout(stand_in_node):
+    slow = stand_in_node(answer({'eth_getLogs': []}), delays={'eth_getLogs': 2})
+    fast = stand_in_node(answer({'eth_getLogs': []}))
+    pool = RPCPool([slow.url, fast.url], timeout=0.3)
+
+    assert Web3(pool).eth.get_logs({'fromBlock': 1, 'toBlock': 2}) == []
+    assert slow.calls == ['eth_getLogs'] and fast.calls == ['eth_getLogs']
+    assert pool.ranked()[0].url == fast.url
+
+
+def test_slow_reads_are_hedged(stand_in_node):
+    slow = stand_in_node(answer({'eth_chainId': '0x1'}), delays={'eth_chainId': 1})
+    fast = stand_in_node(answer({'eth_chainId': '0x2'}))
+    pool = RPCPool([slow.url, fast.url], min_hedge_delay=0.05)
+
+    start = time.monotonic()
+    assert Web3(pool).eth.chain_id == 2
+    assert time.monotonic() - start < 0.5
+    assert slow.calls == ['eth_chainId'] and fast.calls == ['eth_chainId']
+
+
+def test_sends_are_not_hedged(stand_in_node):
+    slow = stand_in_node(answer({'eth_sendRawTransaction': TX_HASH}), delays={'eth_sendRawTransaction': 0.3})
+    fast = stand_in_node(answer({'eth_sendRawTransaction': TX_HASH}))
+    pool = RPCPool([slow.url, fast.url], min_hedge_delay=0.05)
+
+    assert Web3(pool).eth.send_raw_transaction(RAW_TX) == HexBytes(TX_HASH)
+    assert slow.calls == ['eth_sendRawTransaction'] and fast.calls == []
+
+
+def test_send_already_known_after_a_timeout(stand_in_node):
+    # The first endpoint broadcasts the transaction but answers too late, the second one already has it
+    slow = stand_in_node(answer({'eth_sendRawTransaction': TX_HASH}), delays={'eth_sendRawTransaction': 2})
+    known = stand_in_node(answer({'eth_sendRawTransaction': NodeError("already known")}))
+    pool = RPCPool([slow.url, known.url], timeout=0.3)
+
+    assert Web3(pool).eth.send_raw_transaction(RAW_TX) == HexBytes(TX_HASH)
+
+
+def test_send_nonce_too_low_for_our_own_mined_transaction(stand_in_node):
+    # By the time the send fails over, the transaction was mined and its nonce is used
+    slow = stand_in_node(answer({'eth_sendRawTransaction': TX_HASH}), delays={'eth_sendRawTransaction': 2})
+    mined = stand_in_node(answer({'eth_sendRawTransaction': NodeError("nonce too low"),
+                                  'eth_getTransactionByHash': {'hash': TX_HASH, 'blockNumber': '0x5'}}))
+    pool = RPCPool([slow.url, mined.url], timeout=0.3)
+
+    assert Web3(pool).eth.send_raw_transaction(RAW_TX) == HexBytes(TX_HASH)
+    assert mined.calls == ['eth_sendRawTransaction', 'eth_getTransactionByHash']
+
+
+def test_send_nonce_too_low_for_another_transaction(stand_in_node):
+    node = stand_in_node(answer({'eth_sendRawTransaction': NodeError("nonce too low"),
+                                 'eth_getTransactionByHash': None}))
+    pool = RPCPool([node.url])
+
+    with pytest.raises(Web3RPCError, match="nonce too low"):
+        Web3(pool).eth.send_raw_transaction(RAW_TX)
+
+
+def test_errors_mentioning_429_are_not_overload(stand_in_node):
+    # Digits in the message or the data of an ordinary error must not make the pool retry it
+    node = stand_in_node(answer({'eth_sendRawTransaction': NodeError(
+        "insufficient funds for gas * price + value: balance 104290000000", data={'capacity': "unavailable"})}))
+    pool = RPCPool([node.url])
+
+    start = time.monotonic()
+    with pytest.raises(Web3RPCError, match="insufficient funds"):
+        Web3(pool).eth.send_raw_transaction(RAW_TX)
+    assert time.monotonic() - start < 0.5
+    assert node.calls == ['eth_sendRawTransaction']
+    assert pool.endpoints[0].failures == 0
+
+
+def test_http_429_fails_over(stand_in_node):
+    limited = stand_in_node(answer({'eth_getLogs': NodeError("Too Many Requests", status=429)}))
+    up = stand_in_node(answer({'eth_getLogs': []}))
+    pool = RPCPool([limited.url, up.url])
+
+    assert Web3(pool).eth.get_logs({'fromBlock': 1, 'toBlock': 2}) == []
+    assert limited.calls == ['eth_getLogs'] and up.calls == ['eth_getLogs']
+    assert pool.ranked()[0].url == up.url
+
+
+@pytest.mark.parametrize('error', [NodeError("limit exceeded", code=429),
+                                   NodeError("daily request count exceeded, request rate limited", code=-32005)])
+def test_rate_limit_errors_fail_over(stand_in_node, error):
+    limited = stand_in_node(answer({'eth_getLogs': error}))
+    up = stand_in_node(answer({'eth_getLogs': []}))
+    pool = RPCPool([limited.url, up.url])
+
+    assert Web3(pool).eth.get_logs({'fromBlock': 1, 'toBlock': 2}) == []
+    assert pool.endpoints[0].failures == 1
+
+
+def test_pinned_reads_stay_on_one_endpoint(stand_in_node):
+    # The pinned endpoint is slow, a hedged read would have been answered by the other one
+    pinned_node = stand_in_node(answer({'eth_blockNumber': '0x10', 'eth_getLogs': []}),
+                                delays={'eth_blockNumber': 0.3})
+    other = stand_in_node(answer({'eth_blockNumber': '0x8', 'eth_getLogs': []}))
+    pool = RPCPool([pinned_node.url, other.url], min_hedge_delay=0.05)
+    view = Web3(pool.pinned())
+
+    assert view.eth.block_number == 16
+    assert view.eth.get_logs({'fromBlock': 1, 'toBlock': 16}) == []
+    assert pinned_node.calls == ['eth_blockNumber', 'eth_getLogs'] and other.calls == []
+
+
+def test_pinned_reads_do_not_fail_over(stand_in_node):
+    down = stand_in_node(answer({}))
+    up = stand_in_node(answer({'eth_getLogs': []}))
+    pool = RPCPool([down.url, up.url], timeout=1)
+    view = Web3(pool.pinned())
+    down.close()
+
+    with pytest.raises(Exception):
+        view.eth.get_logs({'fromBlock': 1, 'toBlock': 2})
+    assert up.calls == []
+    # The next view pins a healthy endpoint
+    assert Web3(pool.pinned()).eth.get_logs({'fromBlock': 1, 'toBlock': 2}) == []
+
+
+def test_pin_is_kept_while_the_endpoint_is_healthy(stand_in_node):
+    first = stand_in_node(answer({'eth_chainId': '0x1'}), delays={'eth_chainId': 0.1})
+    second = stand_in_node(answer({'eth_chainId': '0x1'}))
+    pool = RPCPool([first.url, second.url])
+
+    Web3(pool.pinned()).eth.chain_id
+    # The second endpoint now ranks first, but the relayer keeps reading from the node it already uses
+    assert pool.ranked()[0].url == second.url
+    assert pool.pinned().endpoint.url == first.url
+
+
+def test_pinned_sends_fail_over(stand_in_node):
+    down = stand_in_node(answer({}))
+    up = stand_in_node(answer({'eth_sendRawTransaction': TX_HASH}))
+    pool = RPCPool([down.url, up.url], timeout=1)
+    view = Web3(pool.pinned())
+    down.close()
+
+    assert view.eth.send_raw_transaction(RAW_TX) == HexBytes(TX_HASH)
@@ -0,0 +1,36 @@
+import pytest
+from eth_account import Account
+
+from signing import sign_ahead, sign_transactions
+
+KEYS = ['0x' + '11' * 32, '0x' + '22' * 32]
+
+
+def transactions(count):
+    """
+        (private key, transaction dict) of 'count' transfers, alternating between the test keys
+    """
+    return [(KEYS[nonce % len(KEYS)], {'to': '0x' + '33' * 20, 'value': 1, 'gas': 21000, 'gasPrice': 10 ** 9,
+                                       'nonce': nonce, 'chainId': 1}) for nonce in range(count)]
+
+
+def expected(items):
+    signed = [Account.sign_transaction(tx, private_key) for private_key, tx in items]
+    return [(bytes(signed_tx.raw_transaction), bytes(signed_tx.hash)) for signed_tx in signed]
+
+
+def test_sign_transactions_matches_eth_account():
+    items = transactions(3)
+    assert sign_transactions(items) == expected(items)
+
+
+def test_small_batches_are_signed_inline(monkeypatch):
+    # The keys of a batch that fits in one chunk never reach the worker processes
+    monkeypatch.setattr('signing.get_signing_pool', lambda: pytest.fail("started the signing workers"))
+    items = transactions(4)
+    assert list(sign_ahead(items, chunk=4)) == expected(items)
+
+
+def test_large_batches_keep_their_order_across_chunks():
+    items = transactions(5)
+    assert list(sign_ahead(items, chunk=2)) == expected(items)